@@ -1,7 +1,9 @@
 import copy
 import random
 import time
+import itertools
 import math
+import operator
 from collections import deque
 from dataclasses import dataclass
 from typing import Optional, TypeVar
@@ -13,8 +15,16 @@ import logging
 import pyglet.math
 import pyperclip
 
-from hack.path_finding import navigate, get_player_coord_from_state
+from hack.path_finding import navigate, navigate_legs, get_player_coord_from_state
+from hack.background_search import BackgroundSearch, can_search_in_background
+from hack.navmesh import NavmeshBuilder
+from hack.history import SimHistory
+from hack.profiler import tick_profiler
+from hack.hud import HudText, HudTexts, PointCloud, overlay_batch
+from hack.submit import SubmitPipeline
+from hack.session import NO_TICK, Session, save_session, session_path
 import hack.constants as vk
+import hack.path_finding as path_finding
 import hack.hack_util as hack_util
 
 import constants
@@ -44,7 +54,425 @@ def smart_dup(value) -> any:
     return value
 
 
+def same_value(a, b) -> bool:
+    if a is b:
+        # a live container or Point aliased with a snapshot may have been mutated in place
+        return not isinstance(a, _MUTABLE_TYPES)
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (list, deque, tuple)):
+        return len(a) == len(b) and all(map(same_value, a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same_value(v, b[k]) for k, v in a.items())
+    if isinstance(a, engine.hitbox.Point):
+        return a.x == b.x and a.y == b.y
+    if isinstance(a, (int, float, complex, str, bytes, set, frozenset)):
+        return a == b
+    # everything else is stored by reference in the snapshot
+    return False
+
+
+_MISSING = object()
+
+POINT_POOL_LIMIT = 1 << 16
+_point_pool = {}
+
+
+def intern_point(point: engine.hitbox.Point) -> engine.hitbox.Point:
+    # Snapshot Points are shared by every snapshot with the same coordinates,
+    # restored objects get copies of them (see thaw).
+    key = (point.__class__, point.x, point.y)
+    pooled = _point_pool.get(key)
+    if pooled is None:
+        if len(_point_pool) >= POINT_POOL_LIMIT:
+            _point_pool.clear()
+        pooled = _point_pool[key] = copy.deepcopy(point)
+    return pooled
+
+
+def shared_dup(value, prev=_MISSING) -> any:
+    """smart_dup that hands back `prev`, or the parts of it, that did not change."""
+    if isinstance(value, (list, deque)):
+        if type(prev) is type(value) and len(prev) == len(value):
+            items = [shared_dup(v, p) for v, p in zip(value, prev)]
+            if all(map(operator.is_, items, prev)):
+                return prev
+            return value.__class__(items)
+        return value.__class__(shared_dup(v) for v in value)
+    if isinstance(value, set):
+        if type(prev) is type(value) and value == prev:
+            return prev
+        return smart_dup(value)
+    if isinstance(value, dict):
+        if type(prev) is dict and prev.keys() == value.keys():
+            items = {k: shared_dup(v, prev[k]) for k, v in value.items()}
+            if all(items[k] is prev[k] for k in items):
+                return prev
+            return items
+        return {k: shared_dup(v) for k, v in value.items()}
+    if isinstance(value, engine.hitbox.Point):
+        if type(prev) is type(value) and prev is not value and prev.x == value.x and prev.y == value.y:
+            return prev
+        return intern_point(value)
+    if prev is not _MISSING and same_value(value, prev):
+        return prev
+    return value
+
+
+def thaw(value) -> any:
+    """Gives a restored object its own containers and Points so it can't mutate shared snapshots."""
+    if isinstance(value, (list, set, deque)):
+        return value.__class__(thaw(v) for v in value)
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, engine.hitbox.Point):
+        return copy.deepcopy(value)
+    return value
+
+
+class DeltaProperties:
+    """Properties recorded as the changes on top of a parent snapshot."""
+    __slots__ = ('base', 'changes', 'depth')
+
+    def __init__(self, base, changes: Properties, depth: int):
+        self.base = base
+        self.changes = changes
+        self.depth = depth
+
+    def resolve(self) -> Properties:
+        chain = []
+        props = self
+        while isinstance(props, DeltaProperties):
+            chain.append(props.changes)
+            props = props.base
+        resolved = dict(props)
+        for changes in reversed(chain):
+            resolved.update(changes)
+        return Properties(resolved.items())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __repr__(self):
+        return repr(self.resolve())
+
+
+_SCALAR_TYPES = (int, float, complex, str, bytes, type(None), frozenset)
+_CONTAINER_TYPES = (list, set, deque, dict)
+_MUTABLE_TYPES = (*_CONTAINER_TYPES, engine.hitbox.Point)
+
+# kind -> (source copying `{v}` into a full backup, source testing whether `v`
+# differs from the previous value `p`, source turning `v` into its snapshot copy)
+_LAYOUT_KINDS = {
+    'scalar': ('{v}', 'v.__class__ is not p.__class__ or v != p', None),
+    'tuple': ('{v}', 'not same_value(v, p)', None),
+    'point': ('deepcopy({v})', 'v is p or v.__class__ is not p.__class__ or v.x != p.x or v.y != p.y', 'intern_point(v)'),
+    'container': ('smart_dup({v})', None, 'shared_dup(v, p)'),
+    'ref': ('{v}', 'v is not p', None),
+}
+
+
+def attr_kind(t: type) -> str:
+    if issubclass(t, _CONTAINER_TYPES):
+        return 'container'
+    if issubclass(t, engine.hitbox.Point):
+        return 'point'
+    if issubclass(t, tuple):
+        return 'tuple'
+    if issubclass(t, _SCALAR_TYPES):
+        return 'scalar'
+    return 'ref'
+
+
+class BackupLayout:
+    """generic_backup compiled for one attribute layout of one class."""
+
+    def __init__(self, cls: type, keys: tuple, types: tuple, ignore_attrs):
+        kinds = [(key, attr_kind(t)) for key, t in zip(keys, types) if key not in ignore_attrs]
+        self.mutable_keys = frozenset(key for key, kind in kinds if kind in ('container', 'point'))
+
+        full = ['def backup(d):', '    return (']
+        delta = ['def backup_delta(d, values, changes):', '    get = values.get']
+        for key, kind in kinds:
+            copy_src, changed_src, dup_src = _LAYOUT_KINDS[kind]
+            full.append(f'        ({key!r}, {copy_src.format(v=f"d[{key!r}]")}),')
+            delta.append(f'    v = d[{key!r}]')
+            delta.append(f'    p = get({key!r}, MISSING)')
+            if changed_src is None:
+                delta.append(f'    v = {dup_src}')
+                delta.append(f'    if v is not p:')
+            else:
+                delta.append(f'    if {changed_src}:')
+                if dup_src is not None:
+                    delta.append(f'        v = {dup_src}')
+            delta.append(f'        values[{key!r}] = v')
+            delta.append(f'        changes.append(({key!r}, v))')
+        full.append('    )')
+
+        namespace = {
+            'MISSING': _MISSING,
+            'deepcopy': copy.deepcopy,
+            'smart_dup': smart_dup,
+            'shared_dup': shared_dup,
+            'same_value': same_value,
+            'intern_point': intern_point,
+        }
+        src = '\n'.join(full) + '\n\n' + '\n'.join(delta) + '\n'
+        exec(compile(src, f'<backup layout of {cls.__qualname__}>', 'exec'), namespace)
+        self.backup = namespace['backup']
+        self.backup_delta = namespace['backup_delta']
+
+
+MAX_LAYOUTS_PER_CLASS = 8
+
+
+class BackupSpecializer:
+    def __init__(self):
+        self.enabled = True
+        # (cls, ignore_attrs) -> {(keys, types): BackupLayout or None}
+        self.layouts = {}
+        # cls -> keys that have held a container or a Point in any layout
+        self.mutable_keys = {}
+        # classes with layouts that were left generic, their keys are not all known
+        self.generic_classes = set()
+
+    def layout(self, obj: object, ignore_attrs) -> Optional[BackupLayout]:
+        if not self.enabled:
+            return None
+        cls = obj.__class__
+        d = obj.__dict__
+        signature = (tuple(d), tuple(map(type, d.values())))
+        layouts = self.layouts.get((cls, ignore_attrs))
+        if layouts is None:
+            layouts = self.layouts[(cls, ignore_attrs)] = {}
+        try:
+            return layouts[signature]
+        except KeyError:
+            pass
+        # an attribute appeared, vanished or changed type: learn the new layout,
+        # unless the class keeps changing shape and is better off generic
+        layout = None
+        if len(layouts) < MAX_LAYOUTS_PER_CLASS:
+            layout = BackupLayout(cls, *signature, ignore_attrs)
+            self.mutable_keys[cls] = self.mutable_keys.get(cls, frozenset()) | layout.mutable_keys
+        else:
+            self.generic_classes.add(cls)
+        layouts[signature] = layout
+        return layout
+
+    def restore_mutable_keys(self, obj: object):
+        if not self.enabled or obj.__class__ in self.generic_classes:
+            return None
+        return self.mutable_keys.get(obj.__class__)
+
+
+backup_specializer = BackupSpecializer()
+
+
+class TrackDirty:
+    """Mixin flagging the object as dirty whenever one of its attributes is set.
+
+    In-place changes to containers and Points don't go through __setattr__,
+    DirtyTracker compares those by value. Anything writing to __dict__
+    directly has to add the object to dirty_tracker.dirty itself.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        super().__setattr__(key, value)
+        dirty_tracker.dirty.add(id(self))
+
+
+class DirtyTracker:
+    def __init__(self):
+        self.enabled = True
+        # ids of tracked objects written to since their last backup/restore
+        self.dirty = set()
+        self.n_skipped = 0
+        self.n_restored = 0
+
+    def is_clean(self, obj: object, shadow) -> bool:
+        """Whether obj still matches the properties of its last backup/restore."""
+        if not self.enabled or id(obj) in self.dirty or not isinstance(obj, TrackDirty):
+            return False
+        # in-place container and Point mutations don't go through __setattr__
+        mutable_keys = backup_specializer.restore_mutable_keys(obj)
+        if mutable_keys is None:
+            return False
+        d = obj.__dict__
+        values = shadow[2]
+        for key in mutable_keys:
+            if not same_value(d.get(key, _MISSING), values.get(key, _MISSING)):
+                return False
+        return True
+
+    def clean(self, obj: object):
+        self.dirty.discard(id(obj))
+
+
+dirty_tracker = DirtyTracker()
+
+
+class PlayerOnlyTicks:
+    """While active, game ticks leave out the systems path finding does not look at."""
+
+    def __init__(self):
+        self.active = False
+
+
+player_only_ticks = PlayerOnlyTicks()
+
+
+class SkipInPlayerOnlyTicks:
+    """Mixin for systems which don't move the player or the platforms."""
+    __slots__ = ()
+
+    def tick(self, *args, **kwargs):
+        if player_only_ticks.active:
+            return
+        return super().tick(*args, **kwargs)
+
+
+DELTA_KEYFRAME_INTERVAL = 30
+
+
+class SnapshotDeltas:
+    def __init__(self, keyframe_interval=DELTA_KEYFRAME_INTERVAL):
+        self.enabled = True
+        self.keyframe_interval = keyframe_interval
+        self.keyframe = True
+        self.n_backups = 0
+        # id(obj) -> (obj, properties of the last backup/restore, resolved values, chain depth)
+        # The previous generation is only consulted to share values across a keyframe,
+        # so objects that went away are dropped after two keyframes.
+        self.shadows = {}
+        self.old_shadows = {}
+        # (id(obj), name) -> (live value, snapshot copy)
+        self.copies = {}
+        self.old_copies = {}
+
+    def configure(self, enabled=None, keyframe_interval=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if keyframe_interval is not None:
+            self.keyframe_interval = max(1, keyframe_interval)
+        self.n_backups = 0
+        self.shadows, self.old_shadows = {}, {}
+        self.copies, self.old_copies = {}, {}
+
+    def begin_backup(self):
+        self.keyframe = self.n_backups % self.keyframe_interval == 0
+        if self.keyframe:
+            self.shadows, self.old_shadows = {}, self.shadows
+            self.copies, self.old_copies = {}, self.copies
+            dirty_tracker.dirty.intersection_update(self.old_shadows.keys())
+        self.n_backups += 1
+
+    def backup(self, obj: object, ignore_attrs) -> Properties:
+        shadow = self.shadows.get(id(obj))
+        if shadow is None or shadow[0] is not obj:
+            shadow = self.old_shadows.get(id(obj))
+            if shadow is not None and shadow[0] is not obj:
+                shadow = None
+        elif shadow[3] < self.keyframe_interval:
+            if dirty_tracker.is_clean(obj, shadow):
+                return shadow[1]
+            props = self.__backup_delta(obj, ignore_attrs, shadow)
+            dirty_tracker.clean(obj)
+            return props
+
+        prev_values = shadow[2] if shadow is not None else {}
+        values = {
+            key: shared_dup(value, prev_values.get(key, _MISSING))
+            for key, value in obj.__dict__.items()
+            if key not in ignore_attrs
+        }
+        props = Properties(values.items())
+        self.shadows[id(obj)] = (obj, props, values, 0)
+        dirty_tracker.clean(obj)
+        return props
+
+    def __backup_delta(self, obj: object, ignore_attrs, shadow) -> Properties:
+        _, base, values, depth = shadow
+        changes = []
+        layout = backup_specializer.layout(obj, ignore_attrs)
+        if layout is not None:
+            layout.backup_delta(obj.__dict__, values, changes)
+        else:
+            for key, value in obj.__dict__.items():
+                if key in ignore_attrs:
+                    continue
+                prev = values.get(key, _MISSING)
+                value = shared_dup(value, prev)
+                if value is prev:
+                    continue
+                values[key] = value
+                changes.append((key, value))
+        if not changes:
+            return base
+        props = DeltaProperties(base, Properties(changes), depth + 1)
+        self.shadows[id(obj)] = (obj, props, values, depth + 1)
+        return props
+
+    def restore(self, obj: T, state) -> T:
+        shadow = self.shadows.get(id(obj)) or self.old_shadows.get(id(obj))
+        if shadow is not None and shadow[0] is obj and shadow[1] is state and dirty_tracker.is_clean(obj, shadow):
+            dirty_tracker.n_skipped += 1
+            return obj
+        dirty_tracker.n_restored += 1
+
+        if isinstance(state, DeltaProperties):
+            depth = state.depth
+            resolved = state.resolve()
+        else:
+            depth = 0
+            resolved = state
+        d = obj.__dict__
+        mutable_keys = backup_specializer.restore_mutable_keys(obj)
+        if mutable_keys is None:
+            for key, value in resolved:
+                d[key] = thaw(value)
+        else:
+            d.update(resolved)
+            for key in mutable_keys:
+                value = d.get(key)
+                if isinstance(value, _MUTABLE_TYPES):
+                    d[key] = thaw(value)
+        self.shadows[id(obj)] = (obj, state, dict(resolved), depth)
+        dirty_tracker.clean(obj)
+        return obj
+
+    def shared_deepcopy(self, obj: object, name: str, live):
+        cached = self.copies.get((id(obj), name)) or self.old_copies.get((id(obj), name))
+        if cached is not None and cached[0] is live:
+            dup = cached[1]
+        else:
+            dup = copy.deepcopy(live)
+        if self.enabled:
+            self.copies[(id(obj), name)] = (live, dup)
+        return dup
+
+    def is_copy_of(self, obj: object, name: str, live, dup) -> bool:
+        cached = self.copies.get((id(obj), name)) or self.old_copies.get((id(obj), name))
+        return cached is not None and cached[0] is live and cached[1] is dup
+
+    def restored_copy(self, obj: object, name: str, live, dup):
+        if self.enabled:
+            self.copies[(id(obj), name)] = (live, dup)
+
+
+snapshot_deltas = SnapshotDeltas()
+
+
 def generic_backup(obj: object, ignore_attrs=()) -> Properties:
+    if snapshot_deltas.enabled:
+        return snapshot_deltas.backup(obj, ignore_attrs)
+    layout = backup_specializer.layout(obj, ignore_attrs)
+    if layout is not None:
+        return layout.backup(obj.__dict__)
     return Properties(
         (key, smart_dup(value))
         for key, value in obj.__dict__.items()
@@ -53,8 +481,9 @@ def generic_backup(obj: object, ignore_attrs=()) -> Properties:
 
 
 def generic_restore(obj: T, state: Properties):
-    for key, value in state:
-        obj.__dict__[key] = value
+    if snapshot_deltas.enabled:
+        return snapshot_deltas.restore(obj, state)
+    obj.__dict__.update(state)
     return obj
 
 
@@ -135,7 +564,7 @@ engine.rng.RngSystem = HackedRngSystem
 import engine.walk_data
 
 
-class HackedWalkData(engine.walk_data.WalkData):
+class HackedWalkData(TrackDirty, engine.walk_data.WalkData):
     def backup(self) -> Properties:
         return generic_backup(self, ('obj',))
 
@@ -172,7 +601,7 @@ class FakeHashableOutline(set):
         return self.string
 
 
-class HackedGenericObject(engine.generics.GenericObject):
+class HackedGenericObject(TrackDirty, engine.generics.GenericObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.game = None
@@ -184,13 +613,17 @@ class HackedGenericObject(engine.generics.GenericObject):
         return GenericObjectBackupState(
             properties=generic_backup(self, ignore_attrs=('game', 'hashable_outline')),
             walk_data=backup_or_none(self.walk_data),
-            hashable_outline=copy.deepcopy(self.hashable_outline),
+            hashable_outline=snapshot_deltas.shared_deepcopy(self, 'hashable_outline', self.hashable_outline),
         )
 
     def restore(self, state: GenericObjectBackupState):
         generic_restore(self, state.properties)
         self.walk_data = restore_or_none(state.walk_data)
-        self.hashable_outline = state.hashable_outline
+        if not snapshot_deltas.is_copy_of(self, 'hashable_outline', self.hashable_outline, state.hashable_outline):
+            self.hashable_outline = state.hashable_outline
+            snapshot_deltas.restored_copy(self, 'hashable_outline', self.hashable_outline, state.hashable_outline)
+        # the object now matches the backup; the assignments above don't make it dirty
+        dirty_tracker.clean(self)
 
     def _has_health(self):
         # NOTE: only Enemys, Players, and destroyable weapons can take damage
@@ -231,7 +664,7 @@ class HackedGenericObject(engine.generics.GenericObject):
 
             text_color = string_to_color(self.nametype)
 
-            arcade.draw_line(self.game.player.x, self.game.player.y, self.x, self.y, text_color)
+            overlay_batch.add_line(self.game.player.x, self.game.player.y, self.x, self.y, text_color)
 
             if (abs(dx / self.game.gui.camera.scale) >= self.game.gui.camera.viewport_width // 2) or \
                 (abs(dy / self.game.gui.camera.scale) >= self.game.gui.camera.viewport_height // 2):
@@ -271,10 +704,11 @@ class HackedGenericObject(engine.generics.GenericObject):
 
             offset_x += self.game.player.x + 10
             offset_y += self.game.player.y + 10
-            arcade.draw_line(self.game.player.x, self.game.player.y, offset_x, offset_y, arcade.color.YELLOW)
+            overlay_batch.add_line(self.game.player.x, self.game.player.y, offset_x, offset_y, arcade.color.YELLOW)
 
         # Draw line of sight for enemies
-        if self.nametype == 'Enemy':
+        if self.nametype == 'Enemy' and overlay_batch.visible(
+                self.x - self.sight, self.y - self.sight, self.x + self.sight, self.y + self.sight):
             if self.one_sided:
                 if self.sprite.flipped:
                     start_angle = 90.0
@@ -285,20 +719,19 @@ class HackedGenericObject(engine.generics.GenericObject):
             else:
                     start_angle = 0.0
                     end_angle = 360.0
-            arcade.draw_arc_outline(self.x, self.y, self.sight * 2, self.sight * 2,
-                    arcade.color.GREEN, start_angle, end_angle)
-            arcade.draw_arc_filled(self.x, self.y, self.sight * 2, self.sight * 2,
-                    (0, 255, 0, 20), start_angle, end_angle)
+            overlay_batch.add_arc(self.x, self.y, self.sight, start_angle, end_angle,
+                    arcade.color.GREEN, (0, 255, 0, 20))
 
         # Draw healthbar
         if self._has_health():
             bar_width = self.max_health
             bar_height = 10
             bar_padding = 20 if has_drawn_title else 5
-            arcade.draw_xywh_rectangle_outline(self.get_leftmost_point() - bar_width // 2 + self.get_width() // 2,
-                    self.get_highest_point() + bar_padding, bar_width, bar_height, arcade.color.GREEN)
-            arcade.draw_xywh_rectangle_filled(self.get_leftmost_point() - bar_width // 2 + self.get_width() // 2,
-                    self.get_highest_point() + bar_padding, self.health, bar_height, arcade.color.GREEN)
+            bar_x = self.get_leftmost_point() - bar_width // 2 + self.get_width() // 2
+            bar_y = self.get_highest_point() + bar_padding
+            if overlay_batch.visible(bar_x, bar_y, bar_x + bar_width, bar_y + bar_height):
+                overlay_batch.add_rectangle_outline(bar_x, bar_y, bar_width, bar_height, arcade.color.GREEN)
+                overlay_batch.add_rectangle_filled(bar_x, bar_y, self.health, bar_height, arcade.color.GREEN)
 
     @property
     def hashable_outline(self):
@@ -415,7 +848,7 @@ class BasicTileMapBackupState:
     moving_platforms: tuple
 
 
-class HackedBasicTileMap(map_loading.tilemap.BasicTileMap):
+class HackedBasicTileMap(TrackDirty, map_loading.tilemap.BasicTileMap):
     def backup(self) -> BasicTileMapBackupState:
         return BasicTileMapBackupState(
             properties=generic_backup(self, ('moving_platforms','texts','layers','static_objs','parsed_map', 'map_size')),
@@ -453,7 +886,7 @@ class LogicEngineBackupState:
     logic_countdown: int
 
 
-class HackedLogicEngine(engine.logic.LogicEngine):
+class HackedLogicEngine(SkipInPlayerOnlyTicks, engine.logic.LogicEngine):
     def backup(self) -> LogicEngineBackupState:
         return LogicEngineBackupState(
             logic_map=tuple(
@@ -483,7 +916,7 @@ engine.logic.LogicEngine = HackedLogicEngine
 import engine.physics
 
 
-class HackedPhysicsEngine(engine.physics.PhysicsEngine):
+class HackedPhysicsEngine(TrackDirty, engine.physics.PhysicsEngine):
     def backup(self) -> Properties:
         return generic_backup(self, ('player',))
 
@@ -513,7 +946,7 @@ class DanmakuSystemBackupState:
     player_bullets: tuple
 
 
-class HackedDanmakuSystem(engine.danmaku.DanmakuSystem):
+class HackedDanmakuSystem(TrackDirty, SkipInPlayerOnlyTicks, engine.danmaku.DanmakuSystem):
     def backup(self) -> DanmakuSystemBackupState:
         return DanmakuSystemBackupState(
             properties=generic_backup(self, ignore_attrs=('gui', 'player', 'boss')),
@@ -567,7 +1000,7 @@ class GrenadeSystemBackupState:
     grenades: tuple
 
 
-class HackedGrenadeSystem(engine.grenade.GrenadeSystem):
+class HackedGrenadeSystem(TrackDirty, SkipInPlayerOnlyTicks, engine.grenade.GrenadeSystem):
     def backup(self) -> GrenadeSystemBackupState:
         return GrenadeSystemBackupState(
             properties=generic_backup(self, ('game',)),
@@ -603,7 +1036,7 @@ class CombatSystemBackupState:
     active_projectiles: tuple
 
 
-class HackedCombatSystem(engine.combat.CombatSystem):
+class HackedCombatSystem(TrackDirty, SkipInPlayerOnlyTicks, engine.combat.CombatSystem):
     def backup(self) -> CombatSystemBackupState:
         return CombatSystemBackupState(
             properties=generic_backup(self, ('game', 'active_projectiles')),
@@ -651,7 +1084,16 @@ class LudicerBackupState:
     danmaku_system: BackupOrNone
     grenade_system: BackupOrNone
     boss: any
-    sent_game_info: dict
+    sent_game_info: Optional[dict]  # None unless captured eagerly, see game_info_of
+    # keys of the tick that produced this state, None if there was no tick since the last backup/restore
+    tick_keys: Optional[frozenset] = None
+
+
+# 'eager' captures the messages for the server on every sim tick, 'lazy'
+# builds them from the snapshots when they are submitted, which is only right
+# if they depend on nothing but the state after the tick, 'verify' does both
+# and logs where they differ
+GAME_INFO_CAPTURE = 'eager'
 
 
 class FakeNet:
@@ -672,6 +1114,7 @@ class HackedLudicer(ludicer.Ludicer):
     soul_tracer = False
 
     def backup(self) -> LudicerBackupState:
+        snapshot_deltas.begin_backup()
         return LudicerBackupState(
             properties=tuple(
                 (key, getattr(self, key))
@@ -716,6 +1159,7 @@ class HackedLudicer(ludicer.Ludicer):
             grenade_system=backup_or_none(self.grenade_system),
             boss=self.boss,
             sent_game_info=self.__last_sent,
+            tick_keys=self.__dict__.pop('tick_keys', None),
         )
 
     def dump_items(self, *args, **kwargs):
@@ -744,6 +1188,14 @@ class HackedLudicer(ludicer.Ludicer):
         self.grenade_system = restore_or_none(state.grenade_system)
 
         self.__last_sent = None
+        self.__dict__.pop('tick_keys', None)
+
+    def tick(self):
+        # raw_pressed_keys records what the tick read, for re-simulating history
+        self.__dict__['tick_keys'] = None
+        super().tick()
+        if self.__dict__['tick_keys'] is None:
+            self.__dict__['tick_keys'] = frozenset()
 
     def setup(self):
         super().setup()
@@ -760,8 +1212,13 @@ class HackedLudicer(ludicer.Ludicer):
                 o.game = self
 
     def send_game_info(self):
+        if player_only_ticks.active:
+            self.__last_sent = None
+            return
         if self.real_time and not self.simulating:
             super().send_game_info()
+        elif GAME_INFO_CAPTURE == 'lazy':
+            self.__last_sent = None
         else:
             net = self.net
             self.net = FakeNet()
@@ -769,6 +1226,36 @@ class HackedLudicer(ludicer.Ludicer):
             self.__last_sent = self.net.msg
             self.net = net
 
+    def game_info_of(self, state: LudicerBackupState):
+        """The message for the server of the tick that produced state, None if
+        there was no tick. Rebuilt from state unless it was captured; this
+        leaves the game in state."""
+        if state.tick_keys is None:
+            return state.sent_game_info
+        if state.sent_game_info is not None and GAME_INFO_CAPTURE != 'verify':
+            return state.sent_game_info
+
+        self.restore(state)
+        raw_pressed_keys = self.__dict__['raw_pressed_keys']
+        simulating = self.simulating
+        net = self.net
+        # the keys the tick read, as they were after inverted controls
+        self.__dict__['raw_pressed_keys'] = set(state.tick_keys)
+        self.simulating = True
+        self.net = FakeNet()
+        try:
+            super().send_game_info()
+            msg = self.net.msg
+        finally:
+            self.net = net
+            self.simulating = simulating
+            self.__dict__['raw_pressed_keys'] = raw_pressed_keys
+
+        if state.sent_game_info is not None and msg != state.sent_game_info:
+            logging.warning('rebuilt game info differs from the captured one:\n%r\n%r', msg, state.sent_game_info)
+            return state.sent_game_info
+        return msg
+
     @property
     def raw_pressed_keys(self):
         raw_pressed_keys = self.__dict__['raw_pressed_keys']
@@ -787,7 +1274,10 @@ class HackedLudicer(ludicer.Ludicer):
                 elif k2 in raw_pressed_keys:
                     raw_pressed_keys.remove(k2)
                     raw_pressed_keys.add(k1)
-        return frozenset(raw_pressed_keys)
+        keys = frozenset(raw_pressed_keys)
+        if self.__dict__.get('tick_keys', False) is None:
+            self.__dict__['tick_keys'] = keys
+        return keys
 
     @raw_pressed_keys.setter
     def raw_pressed_keys(self, value):
@@ -802,6 +1292,17 @@ class HackedLudicer(ludicer.Ludicer):
 
 ludicer.Ludicer = HackedLudicer
 
+# time each tick and the systems it runs, see hack.profiler
+tick_profiler.wrap(HackedLudicer, 'tick', 'tick')
+tick_profiler.wrap(HackedPhysicsEngine, 'tick', 'physics')
+tick_profiler.wrap(HackedCombatSystem, 'tick', 'combat')
+tick_profiler.wrap(HackedDanmakuSystem, 'tick', 'danmaku')
+tick_profiler.wrap(HackedLogicEngine, 'tick', 'logic')
+tick_profiler.wrap(HackedGrenadeSystem, 'tick', 'grenade')
+tick_profiler.wrap(HackedLudicer, 'send_game_info', 'send_game_info')
+tick_profiler.wrap(HackedLudicer, 'backup', 'backup')
+tick_profiler.wrap(HackedLudicer, 'restore', 'restore')
+
 # ludicer_gui.py
 import ludicer_gui
 
@@ -809,6 +1310,12 @@ ludicer_gui.SCREEN_TITLE += " [Blue Water 💦​]"
 
 REFRESH_RATE_DELTA = (120 - 60) / 10
 
+WAYPOINT_RADIUS = 8  # game units, the markers zoom with the map
+PROFILER_REFRESH = 0.5  # seconds between updates of the profiler overlay
+SCRUB_ACCEL_TIME = 0.5  # seconds Z/X is held before undo/redo goes twice as fast
+SCRUB_MAX_STEP = 64  # frames per update at most
+SCRUBBER_HEIGHT = 8  # pixels, timeline bar along the bottom in sim mode
+SCRUBBER_MARGIN = 10
 SPEED_DIAL = [.1, .2, .5, 1.0, 1.5, 2.0, 4.0, 10.0]
 def get_update_rate(ind):
     ind = max(0, min(len(SPEED_DIAL) - 1, ind))
@@ -822,13 +1329,34 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.__history = []
+        self.__history = SimHistory(self.resimulate)
         self.__history_index = -1  # location of the current state in history
+        self.__scrub_start = None  # when Z/X started being held
+        self.__scrubbing = False  # the scrubber bar is being dragged
         self.__speed_dial = 4
         self.__key_pressed = set()
         self.__mouse = (0, 0)
         self.__free_camera = False
         self.__last_path_find = []
+        self.__search = None  # BackgroundSearch while path finding runs
+        self.__submit = None  # SubmitPipeline while submitted frames go out
+        self.__waypoints = []
+        self.__dragged_waypoint = None
+        self.__leg_cache = {}  # waypoint -> keys of the leg found to it
+        self.__navmesh = NavmeshBuilder()
+        self.__key_log = []  # keys of every tick the server has seen, for bench fixtures and sessions
+        self.__profiler_drawn = (0., [])  # when the profiler overlay was last updated, and its lines
+        self.__hud = {
+            'banner': HudText(18, anchor_x='right', anchor_y='bottom'),
+            'sticky': HudText(16, anchor_x='center', anchor_y='top'),
+            'mouse': HudText(12),
+            'console': HudTexts(font_size=14, anchor_x='left', anchor_y='top'),
+            'console_shadow': HudTexts(font_size=14, anchor_x='left', anchor_y='top'),
+            'profiler': HudTexts(font_size=11, anchor_x='right', anchor_y='top', font_name='Courier New'),
+            'waypoints': HudTexts(font_size=10),
+            'path': PointCloud(arcade.csscolor.BLUE),
+            'visited': PointCloud(arcade.csscolor.GREEN),
+        }
         # self.on_click_start(None)
 
         self.__console = False
@@ -837,6 +1365,15 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
         self.__console_commands = {
             'help': self.cmd_help,
             'dumplogic': self.cmd_logic,
+            'snapshots': self.cmd_snapshots,
+            'history': self.cmd_history,
+            'workers': self.cmd_workers,
+            'rollouts': self.cmd_rollouts,
+            'fixture': self.cmd_fixture,
+            'profile': self.cmd_profile,
+            'gameinfo': self.cmd_gameinfo,
+            'session': self.cmd_session,
+            'seek': self.cmd_seek,
         }
 
         # silly :-)
@@ -849,32 +1386,66 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
 
     def append_history(self, state):
         self.__history_index += 1
-        self.__history = self.__history[:self.__history_index]
+        # what came after the current frame stays around as a branch
+        self.__history.branch_off(self.__history_index)
         self.__history.append(state)
 
-    def restore_history(self, forward):
+    def switch_branch(self):
+        alternatives = self.__history.alternatives(self.__history_index + 1)
+        alternatives = [branch for branch in alternatives if len(branch)]
+        if not alternatives:
+            self.console_add_msg('no other branch here')
+            return
+        branch = alternatives[0]
+        self.__history.switch(branch)
+        self.__history_index = max(min(self.__history_index, len(self.__history) - 1), branch.fork)
+        self.__history_index = self.__history.seek(self.__history_index, forward=False)
+        self.game.restore(self.__history[self.__history_index])
+        self.console_add_msg(f'switched to the branch from frame {branch.fork + 1}, {len(self.__history)} frames')
+
+    def resimulate(self, state, keys_seq) -> list:
+        """Replays recorded ticks from state, leaving the game as it was."""
+        game = self.game
+        current = game.backup()
+        raw_pressed_keys = game.__dict__['raw_pressed_keys']
+        simulating = game.simulating
+        game.simulating = True
+        states = []
+        try:
+            game.restore(state)
+            for keys in keys_seq:
+                if keys is not None:
+                    game.__dict__['raw_pressed_keys'] = set(keys)
+                    game.tick()
+                states.append(game.backup())
+        finally:
+            game.__dict__['raw_pressed_keys'] = raw_pressed_keys
+            game.simulating = simulating
+            game.restore(current)
+        return states
+
+    def restore_history(self, forward, steps=1):
         if forward:
             if self.__history_index + 1 >= len(self.__history):
                 return
-            self.__history_index += 1
+            self.seek_history(self.__history_index + steps, forward)
         else:
             if self.__history_index <= 0:
                 return
-            self.__history_index -= 1
-
-        if self.__history[self.__history_index] is None:
-            # seek
-            self.__history_index += 1 if forward else -1
-            while 0 <= self.__history_index < len(self.__history):
-                state = self.__history[self.__history_index]
-                self.__history_index += 1 if forward else -1
-                if state is None:
-                    break
-            else:
-                raise RuntimeError('seek failed')
+            self.seek_history(self.__history_index - steps, forward)
 
-        if 0 <= self.__history_index < len(self.__history):
-            self.game.restore(self.__history[self.__history_index])
+    def seek_history(self, index, forward):
+        # frames in between are not looked at, map switches are skipped over
+        if len(self.__history) == 0:
+            return
+        index = self.__history.seek(max(0, min(index, len(self.__history) - 1)), forward)
+        if index != self.__history_index:
+            self.__history_index = index
+            self.game.restore(self.__history[index])
+
+    def scrub_steps(self):
+        held = time.time() - self.__scrub_start
+        return min(SCRUB_MAX_STEP, 2 ** int(held / SCRUB_ACCEL_TIME))
 
     def sim_should_run(self):
         return self.game is not None and len(self.game.raw_pressed_keys) > 0
@@ -887,11 +1458,17 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
         return actual_x, actual_y
 
     def extra_draw(self):
+        if self.__submit is not None:
+            text = f'SUBMITTING {self.__submit.n_sent}/{self.__submit.n_total} '
+        else:
+            text = ''
         if self.game.real_time:
-            text = 'REALTIME'
+            text += 'REALTIME'
         else:
-            text = f'SIM ({self.__history_index + 1}/{len(self.__history)}) '
-            if vk.VK_UNDO_FRAME[1] in self.__key_pressed and self.__history_index > 0:
+            text += f'SIM ({self.__history_index + 1}/{len(self.__history)}) '
+            if self.__search is not None:
+                text += f'SEARCHING {len(self.__search.visited)}'
+            elif vk.VK_UNDO_FRAME[1] in self.__key_pressed and self.__history_index > 0:
                 text += 'UNDOING'
             elif vk.VK_REDO_FRAME[1] in self.__key_pressed and self.__history_index < len(self.__history) - 1:
                 text += 'REDOING'
@@ -900,35 +1477,17 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
             else:
                 text += 'PAUSED'
 
-        arcade.draw_text(
-            text + ' (%.1fx)' % (SPEED_DIAL[self.__speed_dial]),
-            self.camera.viewport_width,
-            0,
-            arcade.csscolor.WHITE,
-            18,
-            anchor_x='right',
-            anchor_y='bottom',
-            )
+        hud = self.__hud
+        hud['banner'].draw(
+            text + ' (%.1fx)' % (SPEED_DIAL[self.__speed_dial]), self.camera.viewport_width,
+            0 if self.game.real_time else SCRUBBER_HEIGHT + 2, arcade.csscolor.WHITE)
 
         if self.game and self.game.player and self.game.player.get_height() // 2 == 15:
-            arcade.draw_text(
-                "sticky triggered",
-                self.camera.viewport_width / 2,
-                self.camera.viewport_height,
-                arcade.csscolor.BLUE,
-                16,
-                anchor_x='center',
-                anchor_y='top',
-                )
+            hud['sticky'].draw(
+                "sticky triggered", self.camera.viewport_width / 2, self.camera.viewport_height, arcade.csscolor.BLUE)
 
         x, y = self.window_to_game_coord(*self.__mouse)
-        arcade.draw_text(
-            f'({x:.1f}, {y:.1f})',
-            self.__mouse[0],
-            self.__mouse[1],
-            arcade.csscolor.WHITE,
-            12,
-        )
+        hud['mouse'].draw(f'({x:.1f}, {y:.1f})', self.__mouse[0], self.__mouse[1], arcade.csscolor.WHITE)
 
         console_fontsize = 14
         lines = [(l,arcade.csscolor.WHITE) for l in self.__console_msgs[-5:]]
@@ -938,33 +1497,68 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
                 if cmdname.startswith(self.__console_cmd_buf):
                     lines.append(('>' + cmdname, arcade.csscolor.DIM_GRAY))
         for i,(line,color) in enumerate(lines):
-            arcade.draw_text(
-                line,
-                1,
-                self.camera.viewport_height-i*(console_fontsize*1.15)-1,
-                arcade.csscolor.BLACK,
-                console_fontsize,
-                anchor_x='left',
-                anchor_y='top',
-            )
-            arcade.draw_text(
-                line,
-                0,
-                self.camera.viewport_height-i*(console_fontsize*1.15),
-                color,
-                console_fontsize,
-                anchor_x='left',
-                anchor_y='top',
-            )
+            y = self.camera.viewport_height-i*(console_fontsize*1.15)
+            hud['console_shadow'][i].draw(line, 1, y - 1, arcade.csscolor.BLACK)
+            hud['console'][i].draw(line, 0, y, color)
+
+        if tick_profiler.enabled:
+            now = time.time()
+            if now - self.__profiler_drawn[0] > PROFILER_REFRESH:
+                self.__profiler_drawn = now, tick_profiler.report()
+            for i, line in enumerate(self.__profiler_drawn[1]):
+                hud['profiler'][i].draw(
+                    line, self.camera.viewport_width, self.camera.viewport_height - i * 14, arcade.csscolor.YELLOW)
+
+        if not self.game.real_time and len(self.__history):
+            self.draw_scrubber()
+        if not self.game.real_time and self.__history.branches:
+            self.draw_branch_map()
 
         self.camera.use()
-        for x, y in self.__last_path_find:
-            arcade.draw_circle_filled(x, y, 1, arcade.csscolor.BLUE)
-        if 'visited' in self.game.__dict__:
-            for x,y,vx,vy in self.game.visited:
-                arcade.draw_circle_filled(x, y, 1, arcade.csscolor.GREEN)
+        overlay_batch.flush((*self.window_to_game_coord(0, 0),
+                             *self.window_to_game_coord(self.camera.viewport_width, self.camera.viewport_height)))
+        if self.__search is not None:
+            path_find, visited = self.__search.best_path, self.__search.visited
+        else:
+            path_find, visited = self.__last_path_find, self.game.__dict__.get('visited', ())
+        hud['path'].draw(path_find)
+        hud['visited'].draw(visited)
+        for i, (x, y) in enumerate(self.__waypoints):
+            arcade.draw_circle_outline(x, y, WAYPOINT_RADIUS, arcade.csscolor.ORANGE, 2)
+            hud['waypoints'][i].draw(str(i + 1), x + WAYPOINT_RADIUS, y + WAYPOINT_RADIUS, arcade.csscolor.ORANGE)
         self.gui_camera.use()
 
+    def draw_scrubber(self):
+        # the whole timeline along the bottom, map switches in orange
+        left, right = SCRUBBER_MARGIN, self.camera.viewport_width - SCRUBBER_MARGIN
+        scale = (right - left) / len(self.__history)
+        arcade.draw_lrtb_rectangle_filled(left, right, SCRUBBER_HEIGHT, 0, arcade.csscolor.DIM_GRAY)
+        arcade.draw_lrtb_rectangle_filled(
+            left, left + (self.__history_index + 1) * scale, SCRUBBER_HEIGHT, 0, arcade.csscolor.WHITE)
+        for start in self.__history.seek_index.starts[1:]:
+            x = left + start * scale
+            arcade.draw_line(x, 0, x, SCRUBBER_HEIGHT, arcade.csscolor.ORANGE, 1)
+
+    def scrubber_frame(self, x):
+        left, right = SCRUBBER_MARGIN, self.camera.viewport_width - SCRUBBER_MARGIN
+        return int((x - left) / (right - left) * len(self.__history))
+
+    def draw_branch_map(self):
+        # the current timeline at the bottom, each branch a row above where it forks off
+        extents = self.__history.branch_extents()
+        end = max(len(self.__history), max(e for _, e, _ in extents))
+        left, width, bottom, row = 10, self.camera.viewport_width / 3, 30, 5
+        scale = width / max(end, 1)
+        arcade.draw_lrtb_rectangle_filled(
+            left, left + len(self.__history) * scale, bottom + row - 1, bottom, arcade.csscolor.WHITE)
+        for n, (fork, branch_end, depth) in enumerate(extents):
+            y = bottom + row * (n + 1)
+            arcade.draw_lrtb_rectangle_filled(
+                left + fork * scale, left + max(branch_end, fork + 1) * scale, y + row - 1, y,
+                arcade.csscolor.GRAY if depth > 1 else arcade.csscolor.ORANGE)
+        x = left + (self.__history_index + 0.5) * scale
+        arcade.draw_line(x, bottom - 2, x, bottom + row * (len(extents) + 1), arcade.csscolor.RED, 1)
+
     def change_refresh_rate(self, delta):
         self.__speed_dial = max(0, min(len(SPEED_DIAL) - 1, self.__speed_dial + delta))
         self.set_update_rate(get_update_rate(self.__speed_dial))
@@ -989,14 +1583,37 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
         if self.game is None:
             return
 
+        if self.__submit is not None:
+            self.poll_submit()
+
         if self.game.real_time:
-            return super().on_update(_delta_time)
+            super().on_update(_delta_time)
+            keys = self.game.__dict__.pop('tick_keys', None)
+            if keys is not None:
+                self.__key_log.append(keys)
+            return
 
-        if vk.VK_UNDO_FRAME[1] in self.__key_pressed:
-            self.restore_history(forward=False)
+        graph = self.__navmesh.update(self.game, defer=self.__submit is not None)
+        if graph is not None:
+            self.console_add_msg(f'navmesh of {self.game.current_map} ready, {len(graph.nodes)} standing spots')
 
-        if vk.VK_REDO_FRAME[1] in self.__key_pressed:
-            self.restore_history(forward=True)
+        if self.__search is not None:
+            # the search result is re-simulated from the current frame, hold still
+            self.poll_search()
+            self.center_camera_to_player()
+            return
+
+        if vk.VK_UNDO_FRAME[1] in self.__key_pressed or vk.VK_REDO_FRAME[1] in self.__key_pressed:
+            # the longer Z/X is held, the faster it goes
+            if self.__scrub_start is None:
+                self.__scrub_start = time.time()
+            steps = self.scrub_steps()
+            if vk.VK_UNDO_FRAME[1] in self.__key_pressed:
+                self.restore_history(forward=False, steps=steps)
+            if vk.VK_REDO_FRAME[1] in self.__key_pressed:
+                self.restore_history(forward=True, steps=steps)
+        else:
+            self.__scrub_start = None
 
         if self.sim_should_run():
             if self.game.map_switch is not None:
@@ -1010,23 +1627,66 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
             self.append_history(self.game.backup())
         self.center_camera_to_player()
 
+    def poll_search(self):
+        search = self.__search
+        keys = search.poll()
+        if keys is None:
+            return
+        self.__search = None
+        self.game.__dict__['visited'] = search.visited
+        if search.leg_cache is not None:
+            self.__leg_cache = search.leg_cache
+        if not keys:
+            self.console_add_msg('Path finding found nothing')
+            return
+        self.add_path(self.resimulate(search.init_state, keys))
+        self.console_add_msg(f'Path finding done, {len(keys)} ticks visiting {len(search.visited)} states')
+
+    def poll_submit(self):
+        submit = self.__submit
+        if submit.sources:
+            # building the messages restores the frames they are for
+            current = self.game.backup()
+            submit.pump()
+            self.game.restore(current)
+        else:
+            submit.pump()
+        with submit.net_lock:
+            self.game.recv_from_server()
+        if self.game.cheating_detected:
+            submit.cancel()
+            self.console_add_msg(f'CHEATING DETECTED after {submit.n_sent}/{submit.n_total} frames, submission stopped')
+        elif submit.error is not None:
+            self.console_add_msg(f'submission failed after {submit.n_sent}/{submit.n_total} frames: {submit.error!r}')
+        if submit.done():
+            if not submit.cancelled.is_set():
+                self.console_add_msg(f'{submit.n_sent} frames submitted')
+            submit.close()
+            self.__submit = None
+
+    def add_path(self, states):
+        self.__last_path_find = []
+        for state in states:
+            self.__last_path_find.append(get_player_coord_from_state(state))
+            self.append_history(state)
+        self.game.restore(self.__history[self.__history_index])
+
     def submit_info(self):
         if self.__history_index < 0:
             return
-        submission = self.__history[:self.__history_index + 1]
-        self.__history = self.__history[self.__history_index + 1:]
+        n_submitted = self.__history_index + 1
         self.__history_index = -1
-        if not self.game.net:
-            return
-        for state in submission:
-            if state is None:
-                continue
-            self.game.net.send_one(state.sent_game_info)
-        # for _ in range(20):
-        #     time.sleep(0.1)
-        #     self.game.recv_from_server()
-        #     if self.game.cheating_detected:
-        #         raise RuntimeError('cheating detected')
+        self.__key_log.extend(self.__history.iter_keys(n_submitted))
+        submitted = self.__history.pop_front(n_submitted)
+        if self.game.net:
+            n_ticks = sum(1 for _ in submitted.iter_keys(len(submitted)))
+            # the frames are only materialized, and the messages built, as they
+            # are queued, see poll_submit
+            states = (state for state in submitted.iter_states(len(submitted))
+                      if state is not None and state.tick_keys is not None)
+            if self.__submit is None:
+                self.__submit = SubmitPipeline(self.game.net)
+            self.__submit.extend(map(self.game.game_info_of, states), n_ticks)
 
     def center_camera_to_player(self):
         if self.__free_camera:
@@ -1085,6 +1745,13 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
         if not ctrl and self.there_is_a_window():
             return False
 
+        if self.__search is not None and (ctrl, symbol) in (
+                vk.VK_SUBMIT_SIM, vk.VK_TOGGLE_SIM, vk.VK_DOUBLE_SHOOT):
+            return True
+        # real-time ticks would go out before the submitted frames
+        if self.__submit is not None and (ctrl, symbol) == vk.VK_TOGGLE_SIM:
+            return True
+
         match (ctrl, symbol):
             case vk.VK_INCR_FRATE:
                 self.change_refresh_rate(1)
@@ -1115,18 +1782,66 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
             case vk.VK_PATHFINDER:
                 if self.game.real_time:
                     return False
-                history = navigate(self.game, *self.window_to_game_coord(*self.__mouse))
+                if self.__search is not None:
+                    self.__search.accept()
+                    return True
+                if self.game.player is None:
+                    return False
+                targets = self.__waypoints + [self.window_to_game_coord(*self.__mouse)]
+                # legs to waypoints that were moved or removed since are no use
+                self.__leg_cache = {t: self.__leg_cache[t] for t in targets if t in self.__leg_cache}
+                if can_search_in_background():
+                    if self.__submit is not None:
+                        # the fork would copy the sender thread's locks and socket mid-use
+                        self.console_add_msg('wait for the submission to finish before path finding')
+                        return True
+                    self.__search = BackgroundSearch(self.game, targets, self.__leg_cache)
+                    return True
+                if len(targets) == 1:
+                    history = navigate(self.game, *targets[0])
+                else:
+                    history = navigate_legs(self.game, targets, leg_cache=self.__leg_cache, use_navmesh=True)
                 if not history:
                     return False
-                self.__last_path_find = []
-                for h in history:
-                    self.__last_path_find.append(get_player_coord_from_state(h))
-                    self.append_history(h)
-                self.game.restore(self.__history[self.__history_index])
+                self.add_path(history)
+                return True
+            case vk.VK_PATHFINDER_CANCEL:
+                if self.__search is not None:
+                    self.__search.cancel()
+                return True
+            case vk.VK_WAYPOINT:
+                if self.game.real_time:
+                    return False
+                x, y = self.window_to_game_coord(*self.__mouse)
+                i = self.waypoint_at(x, y)
+                if i is None:
+                    self.__waypoints.append((x, y))
+                else:
+                    self.__waypoints.pop(i)
+                return True
+            case vk.VK_CLEAR_WAYPOINTS:
+                self.__waypoints = []
+                self.__leg_cache = {}
                 return True
             case vk.VK_IPDB:
                 ipdb.set_trace()
                 return True
+            case vk.VK_PROFILER:
+                tick_profiler.enabled = not tick_profiler.enabled
+                return True
+            case vk.VK_PREV_MAP | vk.VK_NEXT_MAP:
+                if self.game.real_time or self.__search is not None:
+                    return False
+                forward = (ctrl, symbol) == vk.VK_NEXT_MAP
+                index = self.__history.map_start(self.__history_index, forward)
+                if index is not None:
+                    self.seek_history(index, forward)
+                return True
+            case vk.VK_SWITCH_BRANCH:
+                if self.game.real_time or self.__search is not None:
+                    return False
+                self.switch_branch()
+                return True
             case vk.VK_ITEM_TRACER:
                 self.game.item_tracer = not self.game.item_tracer
                 return True
@@ -1170,7 +1885,40 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
     def on_mouse_motion(self, x: int, y: int, dx: int, dy: int):
         self.__mouse = x, y
 
+    def waypoint_at(self, x, y):
+        # x, y in game units, like the circles drawn in extra_draw
+        for i, (wx, wy) in enumerate(self.__waypoints):
+            if math.hypot(wx - x, wy - y) <= WAYPOINT_RADIUS:
+                return i
+        return None
+
+    def on_mouse_press(self, x: int, y: int, button: int, modifiers: int):
+        if (button == arcade.MOUSE_BUTTON_LEFT and y <= SCRUBBER_HEIGHT and self.game is not None
+                and not self.game.real_time and self.__search is None and len(self.__history)):
+            self.__scrubbing = True
+            frame = self.scrubber_frame(x)
+            self.seek_history(frame, forward=frame > self.__history_index)
+            return
+        super().on_mouse_press(x, y, button, modifiers)
+
+    def on_mouse_release(self, x: int, y: int, button: int, modifiers: int):
+        self.__dragged_waypoint = None
+        self.__scrubbing = False
+        super().on_mouse_release(x, y, button, modifiers)
+
     def on_mouse_drag(self, x: int, y: int, dx: int, dy: int, buttons: int, modifiers: int):
+        if self.__scrubbing:
+            if self.__search is None:
+                frame = self.scrubber_frame(x)
+                self.seek_history(frame, forward=frame > self.__history_index)
+            return
+        if buttons == arcade.MOUSE_BUTTON_LEFT and self.game is not None and not self.game.real_time:
+            self.__mouse = x, y
+            if self.__dragged_waypoint is None:
+                self.__dragged_waypoint = self.waypoint_at(*self.window_to_game_coord(x - dx, y - dy))
+            if self.__dragged_waypoint is not None:
+                self.__waypoints[self.__dragged_waypoint] = self.window_to_game_coord(x, y)
+            return
         if buttons != arcade.MOUSE_BUTTON_RIGHT:
             return
         self.__free_camera = True
@@ -1217,6 +1965,160 @@ class HackedHackceler8(ludicer_gui.Hackceler8):
     def cmd_help(self):
         self.console_add_msg('NO ONE IS HERE TO HELP YOU. NO ONE LOVES YOU.')
 
+    def cmd_snapshots(self, mode=None, keyframe_interval=None):
+        if mode not in (None, 'delta', 'full'):
+            self.console_add_msg('usage: snapshots [delta|full] [keyframe interval]')
+            return
+        snapshot_deltas.configure(
+            enabled=None if mode is None else mode == 'delta',
+            keyframe_interval=None if keyframe_interval is None else int(keyframe_interval),
+        )
+        self.console_add_msg('snapshots: %s, keyframe every %d frames, %d/%d restores skipped' % (
+            'delta' if snapshot_deltas.enabled else 'full', snapshot_deltas.keyframe_interval,
+            dirty_tracker.n_skipped, dirty_tracker.n_skipped + dirty_tracker.n_restored))
+
+    def cmd_history(self, option=None, value=None):
+        match option:
+            case None:
+                pass
+            case 'budget':
+                self.__history.memory_budget = int(float(value) * (1 << 20))
+            case 'spill':
+                self.__history.spill = value == 'on'
+            case 'replay':
+                self.__history.replay = value == 'on'
+            case _:
+                self.console_add_msg('usage: history [budget <MiB>|spill on|spill off|replay on|replay off]')
+                return
+        self.console_add_msg('history: ' + self.__history.stats())
+        self.console_add_msg('budget %.0f MiB, spill %s, replay %s' % (
+            self.__history.memory_budget / (1 << 20),
+            'on' if self.__history.spill else 'off',
+            'on' if self.__history.replay else 'off'))
+
+    def cmd_workers(self, n=None):
+        if n is not None:
+            path_finding.PARALLEL_WORKERS = max(0, int(n))
+        n = path_finding.PARALLEL_WORKERS
+        self.console_add_msg(f'path finding workers: {n if n > 1 else "serial"}')
+
+    def cmd_rollouts(self, mode=None):
+        if mode not in (None, 'full', 'player'):
+            self.console_add_msg('usage: rollouts [full|player]')
+            return
+        if mode is not None:
+            path_finding.PLAYER_ONLY_ROLLOUTS = mode == 'player'
+        self.console_add_msg(f'path finding rollouts: {"player" if path_finding.PLAYER_ONLY_ROLLOUTS else "full"} ticks')
+
+    def cmd_fixture(self, name=None):
+        if name is None or self.game is None or self.game.player is None:
+            self.console_add_msg('usage: fixture <name>, saves a bench fixture with the cursor as the target')
+            return
+        from hack.bench import save_fixture
+        keys = self.__key_log + list(self.__history.iter_keys(self.__history_index + 1))
+        path = save_fixture(name, self.game, keys, self.window_to_game_coord(*self.__mouse))
+        self.console_add_msg(f'fixture of {len(keys)} ticks written to {path}')
+
+    def cmd_profile(self, option=None, path=None):
+        match option, path:
+            case None, None:
+                pass
+            case ('on' | 'off'), None:
+                tick_profiler.enabled = option == 'on'
+            case 'reset', None:
+                tick_profiler.reset()
+            case 'trace', str():
+                tick_profiler.export_chrome_trace(path)
+            case 'csv', str():
+                tick_profiler.export_csv(path)
+            case _:
+                self.console_add_msg('usage: profile [on|off|reset|trace <file>|csv <file>]')
+                return
+        self.console_add_msg(f'profiler {"on" if tick_profiler.enabled else "off"}, {len(tick_profiler.events)} calls recorded')
+
+    def cmd_gameinfo(self, mode=None):
+        global GAME_INFO_CAPTURE
+        if mode not in (None, 'lazy', 'eager', 'verify'):
+            self.console_add_msg('usage: gameinfo [lazy|eager|verify]')
+            return
+        if mode is not None:
+            GAME_INFO_CAPTURE = mode
+        self.console_add_msg(f'game info capture: {GAME_INFO_CAPTURE}')
+
+    def cmd_session(self, option=None, name=None):
+        match option, name:
+            case 'save', str():
+                self.save_session(session_path(name))
+            case 'load', str():
+                self.load_session(session_path(name))
+            case _:
+                self.console_add_msg('usage: session save <name> | session load <name>')
+
+    def cmd_seek(self, what=None, n=None):
+        if self.game.real_time or self.__search is not None or len(self.__history) == 0:
+            self.console_add_msg('nothing to seek in')
+            return
+        try:
+            match what, n:
+                case str(), None:
+                    self.seek_history(int(what) - 1, forward=False)
+                case 'tick', str():
+                    # ticks since the game started, the submitted ones are not in the history anymore
+                    self.seek_history(self.__history.frame_of_tick(int(n) - len(self.__key_log)), forward=True)
+                case 'map', str() if n.isdigit() and int(n) > 0:
+                    starts = self.__history.seek_index.starts
+                    self.seek_history(starts[min(int(n), len(starts)) - 1], forward=True)
+                case _:
+                    raise ValueError
+        except ValueError:
+            self.console_add_msg('usage: seek <frame> | seek tick <n> | seek map <n>')
+            return
+        self.console_add_msg(f'at frame {self.__history_index + 1}/{len(self.__history)}')
+
+    def save_session(self, path):
+        frames = list(self.__history.iter_timeline(NO_TICK))
+        index = self.__history_index
+        # a loaded session starts with the state it was loaded onto, which is no tick
+        while frames and frames[0] is NO_TICK:
+            frames.pop(0)
+            index -= 1
+        timeline = self.__key_log + frames
+        index += len(self.__key_log)
+        save_session(path, timeline, index, self.game.current_map)
+        self.console_add_msg(f'session of {len(timeline)} frames written to {path}')
+
+    def load_session(self, path):
+        # the session is played on from the state right after the ticks the
+        # server has seen, which is only around while there are no sim frames
+        if self.game is None or len(self.__history):
+            self.console_add_msg('submit the sim frames up to the last one first')
+            return
+        if self.__search is not None or self.__submit is not None:
+            self.console_add_msg('wait for the search or the submission to finish first')
+            return
+        try:
+            session = Session(path)
+        except (OSError, ValueError) as e:
+            self.console_add_msg(f'could not load {path}: {e}')
+            return
+        try:
+            n_sent = len(self.__key_log)
+            frames = iter(session)
+            prefix = list(itertools.islice(frames, n_sent))
+            if len(prefix) < n_sent or any(
+                    keys is None or keys is NO_TICK or keys != frozenset(sent)
+                    for keys, sent in zip(prefix, self.__key_log)):
+                self.console_add_msg(f'the {n_sent} ticks sent to the server are not how {path} starts')
+                return
+            self.__history.load_timeline(self.game.backup(), frames, NO_TICK)
+            index = max(0, min(session.index - n_sent + 1, len(self.__history) - 1))
+        finally:
+            session.close()
+        self.game.real_time = False
+        self.__history_index = self.__history.seek(index, forward=False)
+        self.game.restore(self.__history[self.__history_index])
+        self.console_add_msg(f'session of {len(self.__history) - 1} frames loaded from {path}')
+
     def cmd_logic(self):
         if not self.game:
             self.console_add_msg('no game')
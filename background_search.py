@@ -0,0 +1,119 @@
+"""Path finding in a forked copy of the game, so the GUI keeps drawing.
+
+The search process streams the visited keys and the best path so far back
+to the GUI, and can be told to give up or to settle for the best path.
+Console messages of the search are forwarded to the GUI too. The
+path comes back as the keys held on each tick, which the GUI re-simulates
+from the state the search started at, along with the leg cache when the
+search went through waypoints.
+"""
+import logging
+import multiprocessing
+import traceback
+
+import hack
+from hack.path_finding import SearchProgress, navigate, navigate_legs
+
+BACKGROUND_TIMEOUT = 60.
+
+
+class _PipeProgress(SearchProgress):
+    def __init__(self, conn):
+        self.conn = conn
+        self.request = None
+
+    def update(self, new_visited, best_path):
+        self.conn.send(('progress', new_visited, best_path))
+
+    def stop_requested(self):
+        while self.conn.poll():
+            self.request = self.conn.recv()
+        return self.request
+
+
+class _PipeConsole:
+    """Stands in for the GUI in the search process."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def console_add_msg(self, line):
+        self.conn.send(('console', line))
+
+
+def _search_main(conn, game, targets, leg_cache, timeout):
+    hack._G_WINDOW = _PipeConsole(conn)
+    try:
+        if len(targets) == 1:
+            path = navigate(game, *targets[0], _PipeProgress(conn), timeout)
+        else:
+            path = navigate_legs(game, targets, _PipeProgress(conn), timeout, leg_cache, use_navmesh=True)
+        conn.send(('done', None if path is None else [state.tick_keys for state in path], leg_cache))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+def can_search_in_background() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+class BackgroundSearch:
+    def __init__(self, game, targets, leg_cache=None, timeout=BACKGROUND_TIMEOUT):
+        self.targets = targets
+        self.leg_cache = leg_cache
+        self.init_state = game.backup()
+        self.visited = []
+        self.best_path = []
+        self.result = None
+
+        ctx = multiprocessing.get_context('fork')
+        self.conn, child_conn = ctx.Pipe()
+        # not a daemon, the parallel search forks workers of its own
+        self.process = ctx.Process(target=_search_main, args=(child_conn, game, targets, leg_cache, timeout))
+        self.process.start()
+        child_conn.close()
+
+    def cancel(self):
+        self.__request('cancel')
+
+    def accept(self):
+        self.__request('accept')
+
+    def __request(self, request):
+        try:
+            self.conn.send(request)
+        except OSError:
+            pass
+
+    def poll(self):
+        """Takes in what the search sent so far. Returns the keys of the path
+        once it is over, an empty list if nothing was found."""
+        try:
+            while self.conn.poll():
+                message = self.conn.recv()
+                match message:
+                    case ('progress', new_visited, best_path):
+                        self.visited.extend(new_visited)
+                        self.best_path = best_path
+                    case ('console', line):
+                        hack._G_WINDOW.console_add_msg(line)
+                    case ('done', keys, leg_cache):
+                        self.result = keys or []
+                        self.leg_cache = leg_cache
+                    case ('error', tb):
+                        logging.error('background path finding failed:\n%s', tb)
+                        self.result = []
+        except (EOFError, OSError):
+            if self.result is None:
+                logging.error('background path finding died')
+                self.result = []
+        if self.result is not None:
+            self.close()
+        return self.result
+
+    def close(self):
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
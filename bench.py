@@ -0,0 +1,242 @@
+"""Headless benchmarks.
+
+Put the repository under game/hack as usual and run `python -m hack.bench`
+from the game directory.
+
+`snapshots` (the default) reports how many bytes each `backup()` keeps
+alive and how long it takes, with full snapshots and with delta snapshots.
+
+`paths` runs the path finder on recorded fixtures and reports ticks/sec,
+backup and restore times, expansions/sec, path lengths, the success rate
+and the peak RSS. A fixture is the keys of every tick since the game
+started plus a target, written by the `fixture <name>` console command:
+snapshots point into the live game, so the fixture state is rebuilt by
+playing the keys on a fresh game, the same way the server does.
+
+Both write their results as JSON with --json, to compare runs.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import hack
+import ludicer
+from hack import path_finding
+from hack.path_finding import get_player_coord_from_state, reached_target, search_counters
+
+BENCH_FIXTURE_DIR = 'bench_fixtures'
+
+
+class HeadlessConsole:
+    """Stands in for the GUI the path finder reports to."""
+
+    def console_add_msg(self, line):
+        logging.debug('CONSOLE: ' + line)
+
+
+def make_game():
+    game = ludicer.Ludicer(None, is_server=True)
+    game.real_time = False
+    game.simulating = True
+    game.__dict__['raw_pressed_keys'] = set()
+    return game
+
+
+def count_objects(game):
+    n = len(game.objects)
+    if game.logic_engine is not None:
+        n += len(game.logic_engine.logic_map)
+    if game.tiled_map is not None:
+        n += len(game.tiled_map.moving_platforms)
+    return n
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def save_fixture(name, game, keys, target) -> str:
+    os.makedirs(BENCH_FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(BENCH_FIXTURE_DIR, name + '.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'map': game.current_map,
+            'player': [game.player.x, game.player.y],
+            'target': list(target),
+            'keys': [sorted(k) for k in keys],
+        }, f)
+    return path
+
+
+def load_fixture(path) -> dict:
+    with open(path) as f:
+        fixture = json.load(f)
+    fixture['name'] = os.path.splitext(os.path.basename(path))[0]
+    return fixture
+
+
+def play_fixture(game, fixture):
+    """Plays the keys of the fixture on a fresh game. Returns the ticks/sec."""
+    t = time.perf_counter()
+    for keys in fixture['keys']:
+        game.__dict__['raw_pressed_keys'] = set(keys)
+        game.tick()
+    elapsed = time.perf_counter() - t
+    game.__dict__['raw_pressed_keys'] = set()
+    return len(fixture['keys']) / elapsed if elapsed > 0 else 0.
+
+
+def measure_backups(game, init_state, n_frames):
+    game.restore(init_state)
+    states = []
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(n_frames):
+            game.tick()
+            before = tracemalloc.get_traced_memory()[0]
+            states.append(game.backup())
+            allocated += tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    game.restore(init_state)
+    backup_time = restore_time = 0.
+    for i in range(n_frames):
+        game.tick()
+        t = time.perf_counter()
+        states[i] = game.backup()
+        backup_time += time.perf_counter() - t
+    for state in reversed(states):
+        t = time.perf_counter()
+        game.restore(state)
+        restore_time += time.perf_counter() - t
+
+    return {
+        'bytes_per_backup': allocated / n_frames,
+        'backup_us': backup_time / n_frames * 1e6,
+        'restore_us': restore_time / n_frames * 1e6,
+    }
+
+
+def bench_fixture(fixture, args) -> dict:
+    game = make_game()
+    result = {'name': fixture['name'], 'ticks': len(fixture['keys'])}
+    result['ticks_per_sec'] = play_fixture(game, fixture)
+    init_state = game.backup()
+    if game.current_map != fixture['map'] or game.player is None:
+        result['error'] = f'fixture ends on {game.current_map}, expected {fixture["map"]}'
+        return result
+    drift = path_finding.distance(game.player.x, game.player.y, *fixture['player'])
+    if drift > path_finding.VERIFY_TOLERANCE:
+        result['drift'] = drift
+
+    result.update(measure_backups(game, init_state, args.frames))
+    game.restore(init_state)
+
+    target = fixture['target']
+    search_counters.reset()
+    t = time.perf_counter()
+    path = path_finding.navigate(game, *target, timeout=args.timeout, use_navmesh=args.navmesh)
+    elapsed = time.perf_counter() - t
+    result.update({
+        'success': bool(path) and reached_target(path[-1], *target),
+        'path_frames': len(path) if path else None,
+        'search_seconds': elapsed,
+        'expansions': search_counters.n_steps,
+        'expansions_per_sec': search_counters.n_steps / search_counters.seconds if search_counters.seconds else 0.,
+        'states': search_counters.n_states,
+        'end': list(get_player_coord_from_state(path[-1])) if path else None,
+    })
+    return result
+
+
+def run_paths(args):
+    hack._G_WINDOW = HeadlessConsole()
+    path_finding.PARALLEL_WORKERS = args.workers
+    path_finding.PLAYER_ONLY_ROLLOUTS = args.rollouts == 'player'
+    paths = args.fixtures or sorted(glob.glob(os.path.join(BENCH_FIXTURE_DIR, '*.json')))
+    if not paths:
+        print(f'no fixtures in {BENCH_FIXTURE_DIR}, record some with the fixture console command')
+        return None
+
+    results = []
+    for path in paths:
+        fixture = load_fixture(path)
+        result = bench_fixture(fixture, args)
+        results.append(result)
+        if 'error' in result:
+            print('{:>20}: {}'.format(result['name'], result['error']))
+            continue
+        print('{:>20}: {:>8.0f} ticks/s {:>8.1f} us/backup {:>8.1f} us/restore {:>8.0f} exp/s {:>5} frames {}'.format(
+            result['name'], result['ticks_per_sec'], result['backup_us'], result['restore_us'],
+            result['expansions_per_sec'], result['path_frames'] or '-', 'ok' if result['success'] else 'FAILED'))
+
+    done = [result for result in results if 'error' not in result]
+    summary = {
+        'success_rate': sum(result['success'] for result in done) / len(done) if done else 0.,
+        'peak_rss_mib': peak_rss_mib(),
+    }
+    print('success rate {:.0%}, peak RSS {:.0f} MiB'.format(summary['success_rate'], summary['peak_rss_mib']))
+    return {
+        'config': {
+            'timeout': args.timeout, 'workers': args.workers, 'rollouts': args.rollouts, 'navmesh': args.navmesh,
+            'frames': args.frames, 'snapshots': 'delta' if hack.snapshot_deltas.enabled else 'full',
+        },
+        'fixtures': results,
+        'summary': summary,
+    }
+
+
+def run_snapshots(args):
+    game = make_game()
+    hack.snapshot_deltas.configure(enabled=False)
+    init_state = game.backup()
+    print(f'{count_objects(game)} objects on {game.current_map}')
+
+    results = {}
+    for mode, enabled in (('full', False), ('delta', True)):
+        hack.snapshot_deltas.configure(enabled=enabled, keyframe_interval=args.keyframe_interval)
+        result = measure_backups(game, init_state, args.frames)
+        results[mode] = result
+        print('{:>6}: {:>10.0f} bytes/backup {:>9.1f} us/backup {:>9.1f} us/restore'.format(
+            mode, result['bytes_per_backup'], result['backup_us'], result['restore_us']))
+    return {'map': game.current_map, 'objects': count_objects(game), 'modes': results, 'peak_rss_mib': peak_rss_mib()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='write the results to this file')
+    subparsers = parser.add_subparsers(dest='command')
+
+    snapshots = subparsers.add_parser('snapshots')
+    snapshots.add_argument('--frames', type=int, default=300)
+    snapshots.add_argument('--keyframe-interval', type=int, default=hack.DELTA_KEYFRAME_INTERVAL)
+
+    paths = subparsers.add_parser('paths')
+    paths.add_argument('fixtures', nargs='*', help=f'fixture files, all of {BENCH_FIXTURE_DIR} by default')
+    paths.add_argument('--frames', type=int, default=100, help='ticks to time backup and restore over')
+    paths.add_argument('--timeout', type=float, default=path_finding.TIMEOUT)
+    paths.add_argument('--workers', type=int, default=path_finding.PARALLEL_WORKERS)
+    paths.add_argument('--rollouts', choices=('full', 'player'), default='full')
+    paths.add_argument('--navmesh', action='store_true', help='plan over cached navmeshes')
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(sys.argv[1:] + ['snapshots'])
+
+    result = run_paths(args) if args.command == 'paths' else run_snapshots(args)
+    if args.json and result is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
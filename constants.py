@@ -5,9 +5,15 @@ VK_MOVE_DOWN  = (False, _arcade.key.S)
 VK_MOVE_LEFT  = (False, _arcade.key.A)
 VK_MOVE_RIGHT = (False, _arcade.key.D)
 VK_PATHFINDER = (False, _arcade.key.H)
+VK_PATHFINDER_CANCEL = (True, _arcade.key.H)
+VK_WAYPOINT = (False, _arcade.key.G)
+VK_CLEAR_WAYPOINTS = (True, _arcade.key.G)
 
 VK_UNDO_FRAME = (False, _arcade.key.Z)
 VK_REDO_FRAME = (False, _arcade.key.X)
+VK_SWITCH_BRANCH = (False, _arcade.key.BRACKETRIGHT)
+VK_PREV_MAP = (True, _arcade.key.Z)
+VK_NEXT_MAP = (True, _arcade.key.X)
 
 VK_PASTE = (True, _arcade.key.V)
 
@@ -23,6 +29,7 @@ VK_CENTER_CAMERA = (False, _arcade.key.C)
 
 VK_IPDB = (False, _arcade.key.I)
 VK_ITEM_TRACER = (False, _arcade.key.L)
+VK_PROFILER = (False, _arcade.key.F3)
 
 VK_CONSOLE = (False, _arcade.key.GRAVE)
 
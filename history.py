@@ -0,0 +1,574 @@
+import bisect
+import dataclasses
+import io
+import logging
+import mmap
+import pickle
+import tempfile
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from typing import Callable, Iterator, Optional
+
+import hack
+import engine.hitbox
+
+HISTORY_LIVE_FRAMES = 600  # 10 seconds at 60 fps
+HISTORY_MEMORY_BUDGET = 256 << 20  # bytes of compressed frames kept in memory
+HISTORY_KEYFRAME_INTERVAL = 60
+HISTORY_SPILL = False
+HISTORY_REPLAY = False  # only keep keyframes, re-simulate everything else
+HISTORY_CACHE_FRAMES = 240
+HISTORY_MAX_BRANCHES = 32
+
+_BY_VALUE_TYPES = {
+    int, float, complex, str, bytes, bool, type(None),
+    tuple, list, dict, set, frozenset, deque,
+}
+
+
+def _is_snapshot_value(obj) -> bool:
+    if type(obj) in _BY_VALUE_TYPES:
+        return True
+    if isinstance(obj, (engine.hitbox.Point, hack.FakeHashableOutline)):
+        return True
+    return dataclasses.is_dataclass(obj) and type(obj).__module__ == hack.__name__
+
+
+class SnapshotPickler(pickle.Pickler):
+    """Pickles backup states by value and the game objects they reference by id."""
+
+    def __init__(self, file, table: 'ObjectTable'):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.table = table
+
+    def reducer_override(self, obj):
+        if type(obj) is hack.DeltaProperties:
+            return tuple, (obj.resolve(),)
+        return NotImplemented
+
+    def persistent_id(self, obj):
+        if _is_snapshot_value(obj) or type(obj) is hack.DeltaProperties:
+            return None
+        return self.table.pid(obj)
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, table: 'ObjectTable'):
+        super().__init__(file)
+        self.table = table
+
+    def persistent_load(self, pid):
+        return self.table.objects[pid]
+
+
+class ObjectTable:
+    """Live objects referenced by pickled snapshots. Keeps them alive."""
+
+    def __init__(self):
+        self.objects = []
+        self.ids = {}
+
+    def pid(self, obj) -> int:
+        pid = self.ids.get(id(obj))
+        if pid is None or self.objects[pid] is not obj:
+            pid = self.ids[id(obj)] = len(self.objects)
+            self.objects.append(obj)
+        return pid
+
+    def clear(self):
+        self.objects.clear()
+        self.ids.clear()
+
+
+def dump_state(state, table: ObjectTable) -> bytes:
+    buf = io.BytesIO()
+    SnapshotPickler(buf, table).dump(state)
+    return zlib.compress(buf.getbuffer(), 1)
+
+
+def load_state(blob, table: ObjectTable):
+    return SnapshotUnpickler(io.BytesIO(zlib.decompress(blob)), table).load()
+
+
+class Frame:
+    __slots__ = ('state', 'blob', 'spill', 'keys')
+
+    def __init__(self, state, keys):
+        self.state = state  # live snapshot, newest frames only
+        self.blob = None  # compressed snapshot
+        self.spill = None  # (offset, length) of the compressed snapshot in the spill file
+        self.keys = keys  # keys of the tick producing this frame, None if there was no tick
+
+    def stored(self) -> bool:
+        return self.state is not None or self.blob is not None or self.spill is not None
+
+
+class Branch:
+    """Frames an alternative timeline has from fork on.
+
+    Its frames before fork are those of parent, or of the current timeline
+    when parent is None.
+    """
+    __slots__ = ('parent', 'fork', 'frames', 'serial')
+
+    def __init__(self, parent, fork, frames, serial):
+        self.parent: Optional[Branch] = parent
+        self.fork = fork
+        self.frames = frames
+        self.serial = serial  # order of creation
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class SeekIndex:
+    """Seek markers, map starts and tick counts of a timeline, kept as frames
+    are appended so seeking is a bisect instead of a walk over the frames.
+
+    The seek markers come in pairs around the frames of a map switch; a map
+    starts right after the second marker of a pair.
+    """
+
+    def __init__(self, frames=()):
+        self.markers = []  # indexes of the seek markers
+        self.starts = [0]  # indexes of the first frame on each map
+        self.ticks = array('Q')  # ticks up to and including each frame
+        for frame in frames:
+            self.append(frame)
+
+    def append(self, frame: Optional[Frame]):
+        index = len(self.ticks)
+        n = self.ticks[-1] if self.ticks else 0
+        if frame is None:
+            self.markers.append(index)
+            if len(self.markers) % 2 == 0:
+                self.starts.append(index + 1)
+        elif frame.keys is not None:
+            n += 1
+        self.ticks.append(n)
+
+    def truncate(self, length: int):
+        del self.ticks[length:]
+        del self.markers[bisect.bisect_left(self.markers, length):]
+        del self.starts[bisect.bisect_right(self.starts, length):]
+
+    def switch_around(self, index: int) -> Optional[tuple[int, int]]:
+        """The markers of the map switch index is in or on, None if it is in none."""
+        i = bisect.bisect_left(self.markers, index)
+        if i % 2 == 0 and (i == len(self.markers) or self.markers[i] != index):
+            return None
+        i -= i % 2
+        end = self.markers[i + 1] if i + 1 < len(self.markers) else len(self.ticks)
+        return self.markers[i], end
+
+
+class SimHistory:
+    """The sim-mode timeline, with older frames compressed, spilled or evicted.
+
+    It is indexed like the list it replaces; None entries are the seek
+    markers around map switches. Evicted frames are re-simulated from the
+    closest stored frame before them with `resimulate(state, keys)`, which
+    returns the snapshot after each tick. In replay mode only every
+    keyframe_interval-th frame keeps its snapshot in the first place.
+    Re-simulated frames are kept in a small cache so scrubbing stays smooth.
+
+    Frames cut off the timeline by `branch_off` are kept as a Branch, which
+    `switch` swaps back in. Only Frame references move around; the frames
+    before the fork are shared. Branch frames only keep their keys (and
+    their place in the spill file) and are re-simulated like evicted frames
+    once switched back to, so they don't eat into the memory budget. At most
+    max_branches branches are kept.
+
+    `seek_index` finds frames by tick count and the map switches without
+    materializing anything.
+    """
+
+    def __init__(
+            self,
+            resimulate: Callable,
+            live_frames=HISTORY_LIVE_FRAMES,
+            memory_budget=HISTORY_MEMORY_BUDGET,
+            keyframe_interval=HISTORY_KEYFRAME_INTERVAL,
+            spill=HISTORY_SPILL,
+            replay=HISTORY_REPLAY,
+            cache_frames=HISTORY_CACHE_FRAMES,
+            max_branches=HISTORY_MAX_BRANCHES,
+    ):
+        self.resimulate = resimulate
+        self.live_frames = live_frames
+        self.memory_budget = memory_budget
+        self.keyframe_interval = keyframe_interval
+        self.spill = spill
+        self.replay = replay
+        self.cache_frames = cache_frames
+        self.max_branches = max_branches
+        self.branches: list[Branch] = []
+        self.n_branches_made = 0
+        self.table = ObjectTable()
+        self.frames: list[Optional[Frame]] = []
+        self.seek_index = SeekIndex()
+        self.blob_bytes = 0
+        self.n_live = 0
+        self.__spill_file = None
+        self.__spill_map = None
+        self.__cache = OrderedDict()  # index -> re-simulated state
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self.frames)
+        if not 0 <= index < len(self.frames):
+            raise IndexError('history index out of range')
+        if self.frames[index] is None:
+            return None
+        return self.__materialize(index)
+
+    def append(self, state):
+        if state is None:
+            self.frames.append(None)
+            self.seek_index.append(None)
+            return
+        self.frames.append(Frame(state, state.tick_keys))
+        self.seek_index.append(self.frames[-1])
+        self.n_live += 1
+        if self.replay:
+            self.__drop_previous()
+        self.__demote()
+
+    def truncate(self, length: int):
+        for frame in self.frames[length:]:
+            self.__forget(frame)
+        del self.frames[length:]
+        self.seek_index.truncate(length)
+        for index in [index for index in self.__cache if index >= length]:
+            del self.__cache[index]
+        if not self.frames:
+            self.clear()
+
+    def branch_off(self, length: int):
+        """Like truncate, but keeps the frames from length on as a branch."""
+        if length >= len(self.frames):
+            return
+        frames = self.frames[length:]
+        del self.frames[length:]
+        self.seek_index.truncate(length)
+        for frame in frames:
+            if frame is not None:
+                self.n_live -= frame.state is not None
+                self.blob_bytes -= len(frame.blob) if frame.blob is not None else 0
+                frame.state = frame.blob = None
+        self.__drop_cache(length)
+        branch = Branch(None, length, frames, self.n_branches_made)
+        self.n_branches_made += 1
+        # branches of the frames cut off now hang off the new branch
+        for other in self.branches:
+            if other.parent is None and other.fork > length:
+                other.parent = branch
+        self.branches.append(branch)
+        while len(self.branches) > self.max_branches:
+            self.__drop_branch()
+
+    def switch(self, branch: Branch):
+        """Makes branch the current timeline, the frames it replaces become a branch."""
+        if branch.parent is not None:
+            self.switch(branch.parent)
+        self.branches.remove(branch)
+        self.branch_off(branch.fork)
+        self.frames.extend(branch.frames)
+        for frame in branch.frames:
+            self.seek_index.append(frame)
+        for other in self.branches:
+            if other.parent is branch:
+                other.parent = None
+
+    def alternatives(self, index: int) -> list[Branch]:
+        """Branches off the current timeline forking at frame index, oldest first."""
+        return sorted((branch for branch in self.branches if branch.parent is None and branch.fork == index),
+                      key=lambda branch: branch.serial)
+
+    def branch_extents(self) -> list[tuple[int, int, int]]:
+        """(fork, end, depth) of every branch, depth counted from the current timeline."""
+        extents = []
+        for branch in self.branches:
+            depth = 1
+            parent = branch.parent
+            while parent is not None:
+                depth += 1
+                parent = parent.parent
+            extents.append((branch.fork, branch.fork + len(branch), depth))
+        return extents
+
+    def seek(self, index: int, forward: bool) -> int:
+        """index, or if that is a map switch, the first frame after it when
+        going forward or the last one before it when going back."""
+        switch = self.seek_index.switch_around(index)
+        if switch is None:
+            return index
+        before, after = switch[0] - 1, switch[1] + 1
+        if forward:
+            return after if after < len(self.frames) else before
+        return before if before >= 0 else min(after, len(self.frames) - 1)
+
+    def frame_of_tick(self, n: int) -> int:
+        """The first frame after n ticks from the start of the timeline."""
+        ticks = self.seek_index.ticks
+        return self.seek(min(bisect.bisect_left(ticks, n), len(ticks) - 1), forward=True)
+
+    def map_start(self, index: int, forward: bool) -> Optional[int]:
+        """The first frame on a map after index, or the last one before it, None if there is none."""
+        starts = self.seek_index.starts
+        if forward:
+            i = bisect.bisect_right(starts, index)
+        else:
+            i = bisect.bisect_left(starts, index) - 1
+        if 0 <= i < len(starts) and starts[i] < len(self.frames):
+            return starts[i]
+        return None
+
+    def __count(self, frames, sign):
+        for frame in frames:
+            if frame is not None:
+                self.n_live += sign * (frame.state is not None)
+                self.blob_bytes += sign * (len(frame.blob) if frame.blob is not None else 0)
+
+    def __drop_cache(self, start):
+        for index in [index for index in self.__cache if index >= start]:
+            del self.__cache[index]
+
+    def __drop_branch(self, branch=None):
+        # the oldest branch nothing else branches off, unless given
+        if branch is None:
+            parents = {other.parent for other in self.branches}
+            branch = min((b for b in self.branches if b not in parents), key=lambda b: b.serial)
+        for other in [other for other in self.branches if other.parent is branch]:
+            self.__drop_branch(other)
+        self.branches.remove(branch)
+        for frame in branch.frames:
+            if frame is not None:
+                frame.state = frame.blob = frame.spill = None
+
+    def iter_states(self, stop: int) -> Iterator:
+        for i in range(stop):
+            yield self[i]
+
+    def iter_timeline(self, no_tick) -> Iterator:
+        """Keys of every frame, None for the seek markers and no_tick for frames without a tick."""
+        for frame in self.frames:
+            if frame is None:
+                yield None
+            else:
+                yield no_tick if frame.keys is None else frame.keys
+
+    def load_timeline(self, state, timeline, no_tick):
+        """Starts over from state, followed by the frames of timeline as given
+        by iter_timeline. They are re-simulated when they are looked at."""
+        self.clear()
+        self.append(state)
+        for keys in timeline:
+            if keys is None:
+                self.frames.append(None)
+            else:
+                self.frames.append(Frame(None, None if keys is no_tick else keys))
+            self.seek_index.append(self.frames[-1])
+
+    def iter_keys(self, stop: int) -> Iterator:
+        """Keys of the ticks up to stop, without materializing anything."""
+        for frame in self.frames[:stop]:
+            if frame is not None and frame.keys is not None:
+                yield frame.keys
+
+    def pop_front(self, n: int) -> 'SimHistory':
+        """Takes the first n frames off into a history of their own, where they
+        are still materialized on demand."""
+        # the new first frame has nothing to be re-simulated from
+        for i in range(n, len(self.frames)):
+            frame = self.frames[i]
+            if frame is not None:
+                if not frame.stored():
+                    frame.state = self.__materialize(i)
+                    self.n_live += 1
+                break
+        front = SimHistory(
+            self.resimulate, self.live_frames, self.memory_budget, self.keyframe_interval,
+            False, self.replay, self.cache_frames, 0)
+        front.table = self.table
+        front.frames = self.frames[:n]
+        for frame in front.frames:
+            if frame is not None and frame.spill is not None:
+                # the spill file stays with this history
+                frame.blob = self.__read_spill(*frame.spill)
+                frame.spill = None
+                self.blob_bytes += len(frame.blob)
+        self.__count(front.frames, -1)
+        front.__count(front.frames, 1)
+        front.seek_index = SeekIndex(front.frames)
+        del self.frames[:n]
+        self.seek_index = SeekIndex(self.frames)
+        self.__cache.clear()
+        # branches forking before n went a way the server didn't, the ones
+        # forking at n have nothing left to be re-simulated from
+        for branch in [branch for branch in self.branches if branch.parent is None and branch.fork <= n]:
+            if branch in self.branches:
+                self.__drop_branch(branch)
+        for branch in self.branches:
+            branch.fork -= n
+        if not self.frames:
+            self.clear()
+        return front
+
+    def clear(self):
+        self.frames.clear()
+        self.seek_index = SeekIndex()
+        self.branches.clear()
+        self.table = ObjectTable()  # frames taken off by pop_front may still use the old one
+        self.blob_bytes = 0
+        self.n_live = 0
+        self.__cache.clear()
+        if self.__spill_map is not None:
+            self.__spill_map.close()
+            self.__spill_map = None
+        if self.__spill_file is not None:
+            self.__spill_file.close()
+            self.__spill_file = None
+
+    def stats(self) -> str:
+        n_frames = sum(frame is not None for frame in self.frames)
+        n_blob = sum(frame is not None and frame.blob is not None for frame in self.frames)
+        n_spill = sum(frame is not None and frame.spill is not None for frame in self.frames)
+        return '%d frames: %d live, %d compressed (%.1f MiB), %d spilled, %d evicted, %d branches' % (
+            n_frames, self.n_live, n_blob, self.blob_bytes / (1 << 20), n_spill,
+            n_frames - self.n_live - n_blob - n_spill, len(self.branches))
+
+    def __forget(self, frame: Optional[Frame]):
+        if frame is None:
+            return
+        if frame.state is not None:
+            self.n_live -= 1
+        if frame.blob is not None:
+            self.blob_bytes -= len(frame.blob)
+        frame.state = frame.blob = frame.spill = None
+
+    def __drop_previous(self):
+        # the newest frame stays live since the next tick starts from it
+        for i in range(len(self.frames) - 2, -1, -1):
+            frame = self.frames[i]
+            if frame is None:
+                continue
+            if i % self.keyframe_interval and frame.state is not None and frame.keys is not None:
+                self.__remember(i, frame.state)
+                frame.state = None
+                self.n_live -= 1
+            return
+
+    def __remember(self, index: int, state):
+        self.__cache[index] = state
+        self.__cache.move_to_end(index)
+        while len(self.__cache) > self.cache_frames:
+            self.__cache.popitem(last=False)
+
+    def __demote(self):
+        i = len(self.frames) - 1 - self.live_frames
+        if i < 0 or self.frames[i] is None or self.frames[i].state is None:
+            return
+        frame = self.frames[i]
+        try:
+            frame.blob = dump_state(frame.state, self.table)
+        except Exception as e:
+            logging.warning('could not compress history frame %d: %r', i, e)
+            return
+        frame.state = None
+        self.n_live -= 1
+        self.blob_bytes += len(frame.blob)
+        if self.blob_bytes > self.memory_budget:
+            self.__enforce_budget()
+
+    def __enforce_budget(self):
+        if self.spill:
+            for frame in self.frames:
+                if self.blob_bytes <= self.memory_budget:
+                    return
+                if frame is not None and frame.blob is not None:
+                    self.__spill_frame(frame)
+            return
+
+        # drop compressed frames that are not keyframes, oldest first,
+        # and space the keyframes further apart if that's not enough
+        stride = self.keyframe_interval
+        while self.blob_bytes > self.memory_budget and stride < len(self.frames):
+            for i, frame in enumerate(self.frames):
+                if self.blob_bytes <= self.memory_budget:
+                    return
+                if i % stride and frame is not None and frame.blob is not None:
+                    self.blob_bytes -= len(frame.blob)
+                    frame.blob = None
+            stride *= 2
+
+    def __spill_frame(self, frame: Frame):
+        if self.__spill_file is None:
+            self.__spill_file = tempfile.TemporaryFile(prefix='hack_history_')
+        f = self.__spill_file
+        offset = f.seek(0, io.SEEK_END)
+        f.write(frame.blob)
+        frame.spill = offset, len(frame.blob)
+        self.blob_bytes -= len(frame.blob)
+        frame.blob = None
+
+    def __read_spill(self, offset: int, length: int) -> bytes:
+        if self.__spill_map is None or offset + length > len(self.__spill_map):
+            if self.__spill_map is not None:
+                self.__spill_map.close()
+            self.__spill_file.flush()
+            self.__spill_map = mmap.mmap(self.__spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.__spill_map[offset:offset + length]
+
+    def __load(self, frame: Frame):
+        if frame.state is not None:
+            return frame.state
+        if frame.blob is not None:
+            return load_state(frame.blob, self.table)
+        if frame.spill is not None:
+            return load_state(self.__read_spill(*frame.spill), self.table)
+        return None
+
+    def __materialize(self, index: int):
+        state = self.__load(self.frames[index])
+        if state is not None:
+            return state
+        state = self.__cache.get(index)
+        if state is not None:
+            self.__cache.move_to_end(index)
+            return state
+
+        # re-simulate from the closest frame we have
+        start = index - 1
+        while start >= 0:
+            state = self.__cache.get(start)
+            if state is not None:
+                break
+            frame = self.frames[start]
+            if frame is not None and frame.stored():
+                state = self.__load(frame)
+                break
+            start -= 1
+        if state is None:
+            raise RuntimeError(f'history frame {index} can not be re-simulated')
+
+        indexes = [i for i in range(start + 1, index + 1) if self.frames[i] is not None]
+        states = self.resimulate(state, [self.frames[i].keys for i in indexes])
+        for i, state in zip(indexes, states):
+            self.__remember(i, state)
+            frame = self.frames[i]
+            if i % self.keyframe_interval == 0 and not frame.stored():
+                # keep keyframes of long stretches so seeking there again is quick
+                try:
+                    frame.blob = dump_state(state, self.table)
+                except Exception as e:
+                    logging.warning('could not compress history frame %d: %r', i, e)
+                    continue
+                self.blob_bytes += len(frame.blob)
+        if self.blob_bytes > self.memory_budget:
+            self.__enforce_budget()
+        return state
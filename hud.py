@@ -0,0 +1,176 @@
+"""Retained-mode pieces for extra_draw.
+
+`arcade.draw_text` lays the text out again on every call and every
+`draw_circle_filled` is its own draw call. These keep an `arcade.Text` per
+slot that only changes when its text does, and put point clouds in shape
+lists that are only built again when the points change. The overlays of
+the game objects (tracers, sight cones, health bars) are gathered the same
+way and drawn together.
+"""
+import math
+
+import arcade
+
+POINT_SIZE = 2  # pixels, side of the square drawn for each point
+POINT_CHUNKS = 32  # shape lists a growing point cloud is split in before it is built again as one
+
+
+class HudText:
+    """An arcade.Text that is laid out again only when something changed."""
+
+    def __init__(self, font_size=12, anchor_x='left', anchor_y='baseline', **kwargs):
+        self.style = dict(font_size=font_size, anchor_x=anchor_x, anchor_y=anchor_y, **kwargs)
+        self.text = None
+        # as last asked for: arcade.Text hands back RGBA colors and float
+        # positions, which would never compare equal to what is passed in
+        self.position = None
+        self.color = None
+
+    def draw(self, text, x, y, color):
+        t = self.text
+        if t is None:
+            # created on first draw, when there surely is a GL context
+            t = self.text = arcade.Text(text, x, y, color, **self.style)
+        else:
+            if t.text != text:
+                t.text = text
+            if self.position != (x, y):
+                t.position = x, y
+            if self.color != color:
+                t.color = color
+        self.position = x, y
+        self.color = color
+        t.draw()
+
+
+class HudTexts:
+    """A growing pool of HudText in the same style, for lists of lines."""
+
+    def __init__(self, **style):
+        self.style = style
+        self.texts = []
+
+    def __getitem__(self, i) -> HudText:
+        while len(self.texts) <= i:
+            self.texts.append(HudText(**self.style))
+        return self.texts[i]
+
+
+class PointCloud:
+    """Points drawn as small squares in one color.
+
+    The shapes are kept until the point list is replaced or shrinks; when it
+    grows only the new points are added, as a shape list of their own.
+    """
+
+    def __init__(self, color, size=POINT_SIZE):
+        self.color = color
+        self.size = size
+        self.source = None
+        self.n_points = 0
+        self.chunks = []
+
+    def __shapes(self, points):
+        h = self.size / 2
+        vertices = []
+        for x, y in points:
+            vertices += ((x - h, y - h), (x + h, y - h), (x + h, y + h), (x - h, y + h))
+        shapes = arcade.ShapeElementList()
+        shapes.append(arcade.create_rectangles_filled_with_colors(vertices, [self.color] * len(vertices)))
+        return shapes
+
+    def draw(self, points):
+        if points is not self.source or len(points) < self.n_points or len(self.chunks) >= POINT_CHUNKS:
+            self.source = points
+            self.n_points = 0
+            self.chunks = []
+        if len(points) > self.n_points:
+            self.chunks.append(self.__shapes(points[self.n_points:]))
+            self.n_points = len(points)
+        for shapes in self.chunks:
+            shapes.draw()
+
+
+ARC_SEGMENTS = 48  # per full circle
+OVERLAY_MARGIN = 64  # pixels around the viewport an overlay may stick out of and still be drawn
+
+
+def _rgba(color):
+    return color if len(color) == 4 else (*color, 255)
+
+
+class OverlayBatch:
+    """The overlays objects draw over themselves, drawn all at once.
+
+    Objects add lines, rectangles and arcs while the game draws them, and
+    extra_draw draws everything with one call per primitive type. The shapes
+    are only built again when the geometry differs from the last frame.
+    Overlays outside the viewport of the last frame are left out.
+    """
+
+    def __init__(self):
+        self.viewport = None  # (x1, y1, x2, y2) in game coordinates, None while unknown
+        self.lines = []
+        self.line_colors = []
+        self.triangles = []
+        self.triangle_colors = []
+        self.__drawn = None  # (geometry, shapes) of the last frame
+
+    def visible(self, x1, y1, x2, y2) -> bool:
+        if self.viewport is None:
+            return True
+        vx1, vy1, vx2, vy2 = self.viewport
+        return x2 >= vx1 - OVERLAY_MARGIN and x1 <= vx2 + OVERLAY_MARGIN and \
+            y2 >= vy1 - OVERLAY_MARGIN and y1 <= vy2 + OVERLAY_MARGIN
+
+    def add_line(self, x1, y1, x2, y2, color):
+        color = _rgba(color)
+        self.lines += ((x1, y1), (x2, y2))
+        self.line_colors += (color, color)
+
+    def add_rectangle_outline(self, x, y, width, height, color):
+        """Rectangle with its bottom left corner at (x, y), like draw_xywh_rectangle_outline."""
+        self.add_line(x, y, x + width, y, color)
+        self.add_line(x + width, y, x + width, y + height, color)
+        self.add_line(x + width, y + height, x, y + height, color)
+        self.add_line(x, y + height, x, y, color)
+
+    def add_rectangle_filled(self, x, y, width, height, color):
+        color = _rgba(color)
+        self.triangles += ((x, y), (x + width, y), (x + width, y + height),
+                           (x, y), (x + width, y + height), (x, y + height))
+        self.triangle_colors += (color,) * 6
+
+    def add_arc(self, x, y, radius, start_angle, end_angle, outline_color, fill_color):
+        """Pie slice between the angles, in degrees counter-clockwise from the right."""
+        n = max(1, round(ARC_SEGMENTS * (end_angle - start_angle) / 360))
+        points = []
+        for i in range(n + 1):
+            angle = math.radians(start_angle + (end_angle - start_angle) * i / n)
+            points.append((x + radius * math.cos(angle), y + radius * math.sin(angle)))
+        outline_color, fill_color = _rgba(outline_color), _rgba(fill_color)
+        for a, b in zip(points, points[1:]):
+            self.lines += (a, b)
+            self.line_colors += (outline_color, outline_color)
+            self.triangles += ((x, y), a, b)
+            self.triangle_colors += (fill_color,) * 3
+
+    def flush(self, viewport):
+        """Draws what was added this frame, in the current camera, and starts the next one."""
+        geometry = (self.lines, self.line_colors, self.triangles, self.triangle_colors)
+        if self.__drawn is None or self.__drawn[0] != geometry:
+            shapes = arcade.ShapeElementList()
+            if self.triangles:
+                shapes.append(arcade.create_triangles_filled_with_colors(self.triangles, self.triangle_colors))
+            if self.lines:
+                shapes.append(arcade.create_lines_with_colors(self.lines, self.line_colors))
+            self.__drawn = geometry, shapes
+        self.__drawn[1].draw()
+        self.viewport = viewport
+        self.lines = []
+        self.line_colors = []
+        self.triangles = []
+        self.triangle_colors = []
+
+
+overlay_batch = OverlayBatch()
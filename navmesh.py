@@ -0,0 +1,286 @@
+"""Reachability graph of the places the player can stand on, per map.
+
+Explored once per map in a forked copy of the game, from wherever the
+player stands when the map is first seen: from each standing spot the
+player runs and jumps both ways, and wherever it lands again becomes a node
+with an edge to it. Graphs are cached on disk by a hash of the map's static
+geometry. Long path finding queries plan over the graph first and only use
+the tick-level search between the waypoints it gives.
+"""
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import time
+from collections import deque
+
+import arcade
+
+import hack
+from hack.occupancy import occupancy_for
+from hack.path_finding import distance, get_player_coord_from_state, macro_keys
+
+NAVMESH_VERSION = 1  # bump when the graph format or the exploration changes
+NAVMESH_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hack_navmesh')
+NAVMESH_CELL = 32  # pixels, standing spots closer than that are one node
+NAVMESH_MAX_NODES = 2000
+NAVMESH_BUILD_TIME = 120.  # seconds
+NAVMESH_FALL_TICKS = 180  # give up on a move when the player is still in the air after that
+NAVMESH_MIN_DISTANCE = 400  # don't bother with the graph for targets closer than that
+NAVMESH_LEG_DISTANCE = 250  # rough distance between waypoints
+NAVMESH_SNAP = 64  # how far the player or the target may be from the closest node
+
+_RUN_TICKS = (5, 20)
+_JUMP_TAP_TICKS = (3, 10)
+_DIRECTIONS = ((arcade.key.A,), (arcade.key.D,))
+
+
+def exploration_macros():
+    macros = []
+    for direction in _DIRECTIONS:
+        for ticks in _RUN_TICKS:
+            macros.append(((direction, ticks),))
+    for direction in _DIRECTIONS + ((),):
+        for tap in _JUMP_TAP_TICKS:
+            macros.append(((direction + (arcade.key.W,), tap), (direction, 1)))
+    return macros
+
+
+class NavGraph:
+    def __init__(self, key):
+        self.key = key
+        self.nodes = {}  # cell -> player coords standing there
+        self.edges = {}  # cell -> {cell: ticks}
+
+    def add_edge(self, a, b, ticks):
+        edges = self.edges.setdefault(a, {})
+        if ticks < edges.get(b, math.inf):
+            edges[b] = ticks
+
+    def nearest(self, x, y, radius=NAVMESH_SNAP):
+        best, best_distance = None, radius
+        cx, cy = int(x // NAVMESH_CELL), int(y // NAVMESH_CELL)
+        r = math.ceil(radius / NAVMESH_CELL)
+        for cell in itertools.product(range(cx - r, cx + r + 1), range(cy - r, cy + r + 1)):
+            coord = self.nodes.get(cell)
+            if coord is not None and distance(x, y, *coord) <= best_distance:
+                best, best_distance = cell, distance(x, y, *coord)
+        return best
+
+    def plan(self, start, goal):
+        """Cells along the fewest ticks from start to goal, None if there is no way."""
+        ticks = {start: 0}
+        came_from = {start: None}
+        pq = [(0, start)]
+        while pq:
+            t, cell = heapq.heappop(pq)
+            if cell == goal:
+                path = []
+                while cell is not None:
+                    path.append(cell)
+                    cell = came_from[cell]
+                path.reverse()
+                return path
+            if t > ticks[cell]:
+                continue
+            for to, edge_ticks in self.edges.get(cell, {}).items():
+                if t + edge_ticks < ticks.get(to, math.inf):
+                    ticks[to] = t + edge_ticks
+                    came_from[to] = cell
+                    heapq.heappush(pq, (t + edge_ticks, to))
+        return None
+
+
+def node_of(x, y):
+    return int(x // NAVMESH_CELL), int(y // NAVMESH_CELL)
+
+
+def explore_edge(game, state, macro):
+    """Plays macro from a standing state and then keeps holding its last
+    keys until the player stands again. Returns the ticks taken and the state
+    landed in, None when the player gets hurt or doesn't land."""
+    game.restore(state)
+    hold = frozenset((arcade.key.LSHIFT, *macro[-1][0]))
+    n_macro = sum(ticks for _, ticks in macro)
+    ticks = 0
+    for keys in itertools.chain(macro_keys(macro), itertools.repeat(hold, NAVMESH_FALL_TICKS)):
+        game.__dict__['raw_pressed_keys'] = keys
+        health = game.player.health
+        game.tick()
+        ticks += 1
+        if game.player.health < health - 10 or game.player.dead:
+            return None
+        if ticks >= n_macro and not game.player.in_the_air:
+            return ticks, game.backup()
+    return None
+
+
+def build_graph(game, key, time_budget=NAVMESH_BUILD_TIME, max_nodes=NAVMESH_MAX_NODES) -> NavGraph:
+    graph = NavGraph(key)
+    init_state = game.backup()
+    deadline = time.time() + time_budget
+    macros = exploration_macros()
+    try:
+        landed = explore_edge(game, init_state, (((), 1),))
+        if landed is None:
+            return graph
+        state = landed[1]
+        coord = get_player_coord_from_state(state)
+        graph.nodes[node_of(*coord)] = coord
+        frontier = deque([(node_of(*coord), state)])
+        while frontier and time.time() < deadline:
+            cell, state = frontier.popleft()
+            for macro in macros:
+                result = explore_edge(game, state, macro)
+                if result is None:
+                    continue
+                ticks, landed_state = result
+                coord = get_player_coord_from_state(landed_state)
+                to = node_of(*coord)
+                if to == cell:
+                    continue
+                if to not in graph.nodes:
+                    if len(graph.nodes) >= max_nodes:
+                        continue
+                    graph.nodes[to] = coord
+                    frontier.append((to, landed_state))
+                graph.add_edge(cell, to, ticks)
+    finally:
+        game.restore(init_state)
+    return graph
+
+
+_map_key = (None, None)  # (grid, key)
+
+
+def map_key(game) -> str:
+    """Hash of the static geometry of the current map."""
+    global _map_key
+    grid = occupancy_for(game)
+    if _map_key[0] is not grid:
+        h = hashlib.sha1(f'{NAVMESH_VERSION} {game.current_map} {grid.width} {grid.height}'.encode())
+        h.update(grid.cells)
+        _map_key = grid, h.hexdigest()
+    return _map_key[1]
+
+
+def cache_path(key) -> str:
+    return os.path.join(NAVMESH_CACHE_DIR, key + '.pickle')
+
+
+def save_graph(graph: NavGraph):
+    os.makedirs(NAVMESH_CACHE_DIR, exist_ok=True)
+    path = cache_path(graph.key)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load_graph(key):
+    try:
+        with open(cache_path(key), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning('could not load navmesh %s: %r', key, e)
+        return None
+
+
+_graphs = {}
+
+
+def has_navmesh(game) -> bool:
+    return game.tiled_map is not None and game.player is not None and game.player.platformer_rules
+
+
+def graph_for(game):
+    if not has_navmesh(game):
+        return None
+    key = map_key(game)
+    graph = _graphs.get(key)
+    if graph is None:
+        graph = load_graph(key)
+        if graph is not None:
+            _graphs[key] = graph
+    return graph
+
+
+def plan_waypoints(game, target_x, target_y) -> list:
+    """Standing spots to go through on the way to the target, empty when the
+    graph has no better idea than going there directly."""
+    x, y = game.player.x, game.player.y
+    if distance(x, y, target_x, target_y) < NAVMESH_MIN_DISTANCE:
+        return []
+    graph = graph_for(game)
+    if graph is None:
+        return []
+    start, goal = graph.nearest(x, y), graph.nearest(target_x, target_y)
+    if start is None or goal is None:
+        return []
+    cells = graph.plan(start, goal)
+    if cells is None:
+        return []
+
+    waypoints = []
+    for cell in cells[1:]:
+        coord = graph.nodes[cell]
+        if distance(x, y, *coord) >= NAVMESH_LEG_DISTANCE:
+            waypoints.append(coord)
+            x, y = coord
+    if waypoints and distance(*waypoints[-1], target_x, target_y) < NAVMESH_LEG_DISTANCE / 2:
+        waypoints.pop()
+    return waypoints
+
+
+def _build_main(game, key):
+    hack.player_only_ticks.active = True
+    game.simulating = True
+    save_graph(build_graph(game, key))
+
+
+class NavmeshBuilder:
+    """Explores each map once, in a forked copy of the game, as maps come up."""
+
+    def __init__(self):
+        self.process = None
+        self.key = None
+        self.seen = None
+        self.tried = set()
+
+    def update(self, game, defer=False):
+        """Called every frame. Returns the graph when one was just built.
+
+        With defer, no build is started yet; the GUI defers them while a
+        submission is sent, as the fork would copy the sender thread's locks
+        and socket mid-use."""
+        if self.process is not None:
+            if self.process.is_alive():
+                return None
+            self.process.join()
+            self.process = None
+            graph = load_graph(self.key)
+            if graph is None:
+                logging.warning('building the navmesh of %s failed', self.key)
+                return None
+            _graphs[self.key] = graph
+            return graph
+
+        seen = game.current_map, id(game.tiled_map)
+        if seen == self.seen or defer:
+            return None
+        self.seen = seen
+        if not has_navmesh(game) or 'fork' not in multiprocessing.get_all_start_methods():
+            return None
+        self.key = map_key(game)
+        if self.key in self.tried or graph_for(game) is not None:
+            return None
+        self.tried.add(self.key)
+        ctx = multiprocessing.get_context('fork')
+        self.process = ctx.Process(target=_build_main, args=(game, self.key), daemon=True)
+        self.process.start()
+        return None
@@ -0,0 +1,150 @@
+"""Occupancy grid of the static geometry of a map, for the path finder.
+
+Built from the walls and hazards among `static_objs` the first time the
+path finder looks at a map, and rebuilt once the map changes. Moving
+platforms are not part of it.
+"""
+import math
+from collections import OrderedDict, deque
+
+CELL_SIZE = 16  # pixels
+WALL_NAMES = ('generic_platform',)
+HAZARD_NAMES = ('spike',)
+FIELD_CACHE = 8  # distance fields kept per map
+
+FREE = 0
+WALL = 1
+HAZARD = 2
+
+_NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def classify(obj) -> int:
+    name = (obj.name or '').lower()
+    if name in WALL_NAMES:
+        return WALL
+    if any(hazard in name for hazard in HAZARD_NAMES):
+        return HAZARD
+    return FREE
+
+
+class OccupancyGrid:
+    """Two layers: `cells` has every cell a wall or hazard touches, for
+    telling free space, and `cores` only the cells they cover completely,
+    for flood fills that must not close off narrow passages."""
+
+    def __init__(self, width, height, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.width = max(1, math.ceil(width / cell_size))
+        self.height = max(1, math.ceil(height / cell_size))
+        self.cells = bytearray(self.width * self.height)
+        self.cores = bytearray(self.width * self.height)
+        self.__fields = OrderedDict()  # target cell -> distance field
+
+    @classmethod
+    def from_game(cls, game, cell_size=CELL_SIZE) -> 'OccupancyGrid':
+        grid = cls(*game.tiled_map.map_size_pixels, cell_size)
+        for obj in game.static_objs:
+            kind = classify(obj)
+            if kind != FREE:
+                grid.fill(obj.get_leftmost_point(), obj.get_lowest_point(),
+                          obj.get_rightmost_point(), obj.get_highest_point(), kind)
+        return grid
+
+    def cell_of(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def __index(self, cx, cy):
+        if 0 <= cx < self.width and 0 <= cy < self.height:
+            return cy * self.width + cx
+        return None
+
+    def __clamp(self, cx1, cy1, cx2, cy2):
+        return max(cx1, 0), max(cy1, 0), min(cx2, self.width - 1), min(cy2, self.height - 1)
+
+    def __touched(self, x1, y1, x2, y2):
+        s = self.cell_size
+        return self.__clamp(math.floor(x1 / s), math.floor(y1 / s), math.ceil(x2 / s) - 1, math.ceil(y2 / s) - 1)
+
+    def __covered(self, x1, y1, x2, y2):
+        s = self.cell_size
+        return self.__clamp(math.ceil(x1 / s), math.ceil(y1 / s), math.floor(x2 / s) - 1, math.floor(y2 / s) - 1)
+
+    def __fill(self, layer, cell_range, kind):
+        cx1, cy1, cx2, cy2 = cell_range
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                i = cy * self.width + cx
+                layer[i] = max(layer[i], kind)
+
+    def fill(self, x1, y1, x2, y2, kind):
+        self.__fill(self.cells, self.__touched(x1, y1, x2, y2), kind)
+        self.__fill(self.cores, self.__covered(x1, y1, x2, y2), kind)
+        self.__fields.clear()
+
+    def at(self, x, y, layer=None) -> int:
+        i = self.__index(*self.cell_of(x, y))
+        if i is None:
+            return WALL
+        return (self.cells if layer is None else layer)[i]
+
+    def is_free(self, x, y) -> bool:
+        return self.at(x, y) == FREE
+
+    def is_solid(self, x, y) -> bool:
+        """Whether (x, y) is deep inside a wall or hazard, or off the map."""
+        return self.at(x, y, self.cores) != FREE
+
+    def box_free(self, x1, y1, x2, y2, margin=0) -> bool:
+        """Whether no wall or hazard comes within margin pixels of the box."""
+        cx1, cy1, cx2, cy2 = self.__touched(x1 - margin, y1 - margin, x2 + margin, y2 + margin)
+        for cy in range(cy1, cy2 + 1):
+            row = cy * self.width
+            if any(self.cells[row + cx1:row + cx2 + 1]):
+                return False
+        return True
+
+    def distance_field(self, x, y):
+        """Steps to the cell of (x, y) for every cell, -1 where it can't be
+        reached. 8-connected flood fill over the cells not covered by walls or
+        hazards, so a diagonal step counts as one, like a move on both axes."""
+        target = self.cell_of(x, y)
+        field = self.__fields.get(target)
+        if field is not None:
+            self.__fields.move_to_end(target)
+            return field
+
+        field = [-1] * len(self.cells)
+        start = self.__index(*target)
+        if start is not None and self.cores[start] == FREE:
+            field[start] = 0
+            queue = deque((target,))
+            while queue:
+                cx, cy = queue.popleft()
+                d = field[cy * self.width + cx] + 1
+                for dx, dy in _NEIGHBOURS:
+                    i = self.__index(cx + dx, cy + dy)
+                    if i is not None and field[i] < 0 and self.cores[i] == FREE:
+                        field[i] = d
+                        queue.append((cx + dx, cy + dy))
+
+        self.__fields[target] = field
+        while len(self.__fields) > FIELD_CACHE:
+            self.__fields.popitem(last=False)
+        return field
+
+    def distance(self, field, x, y) -> int:
+        i = self.__index(*self.cell_of(x, y))
+        return -1 if i is None else field[i]
+
+
+_cached = (None, None)
+
+
+def occupancy_for(game) -> OccupancyGrid:
+    """The grid of the current map, rebuilt when the map switches."""
+    global _cached
+    key = game.current_map, id(game.tiled_map)
+    if _cached[0] != key:
+        _cached = key, OccupancyGrid.from_game(game)
+    return _cached[1]
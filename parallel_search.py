@@ -0,0 +1,243 @@
+"""Path finding spread over forked worker processes.
+
+The workers are forked from the GUI process when a search starts, so each
+of them gets its own copy of the game in the start state without having to
+ship any game state around. The master keeps the priority queue and the
+transposition table, and only knows nodes by the macros played on the way
+there; the workers keep recently expanded states around and replay the
+macros from the closest state they have otherwise. The final path is
+replayed on the real game. Workers inherit player-only ticks from the
+master when they are forked.
+"""
+import heapq
+import logging
+import multiprocessing
+import time
+import traceback
+from collections import OrderedDict
+
+import hack
+from hack.occupancy import occupancy_for
+from hack.path_finding import (
+    CostModel, StateAbstraction, TranspositionTable, TIMEOUT, POSSIBLE_KEYS, POSSIBLE_KEYS_SCROLLER,
+    finish_path, get_player_coord_from_state, macros_for, probe_max_speed, reached_target, replay, rollout,
+    search_counters,
+)
+
+BATCH_SIZE = 4  # nodes sent to each worker per round
+WORKER_CACHE_STATES = 2048
+
+
+class Node:
+    __slots__ = ('id', 'parent', 'macro_index', 'macro', 'ticks', 'cost', 'coord', 'heuristic', 'priority',
+                 'state_key', 'reached', 'owner')
+
+    def __init__(self, id, parent, macro_index, macro, ticks, cost, coord, state_key, reached, owner, cost_model):
+        self.id = id
+        self.parent = parent
+        self.macro_index = macro_index
+        self.macro = macro
+        self.ticks = ticks
+        self.cost = cost
+        self.coord = coord
+        self.heuristic = cost_model.heuristic(*coord)
+        self.priority = cost_model.priority(cost, self.heuristic)
+        self.state_key = state_key
+        self.reached = reached
+        self.owner = owner
+
+    def __lt__(self, other):
+        if self.priority == other.priority:
+            return self.heuristic < other.heuristic
+        return self.priority < other.priority
+
+    def wid(self):
+        # how workers name the state: the node it was expanded from and the macro played
+        return None if self.parent is None else (self.parent.id, self.macro_index)
+
+    def chain(self):
+        chain = []
+        node = self
+        while node.parent is not None:
+            chain.append(node)
+            node = node.parent
+        chain.reverse()
+        return chain
+
+    def edges(self):
+        return [(node.macro, node.ticks, node.coord) for node in self.chain()]
+
+
+def _worker_main(conn, game, root_state, target_x, target_y, cost_model, abstraction):
+    cache = OrderedDict()
+
+    def remember(wid, state):
+        cache[wid] = state
+        cache.move_to_end(wid)
+        if len(cache) > WORKER_CACHE_STATES:
+            cache.popitem(last=False)
+
+    def expand(node_id, chain):
+        state = root_state
+        start = 0
+        for i in range(len(chain) - 1, -1, -1):
+            cached = cache.get(chain[i][0])
+            if cached is not None:
+                state = cached
+                start = i + 1
+                break
+        for wid, macro, ticks in chain[start:]:
+            state = replay(game, state, macro, ticks, keep_states=False)[-1]
+            remember(wid, state)
+
+        children = []
+        for macro_index, macro in enumerate(macros_for(game, state, cost_model)):
+            ticks, child = rollout(game, state, macro)
+            if child is None:
+                continue
+            remember((node_id, macro_index), child)
+            children.append((
+                macro_index, macro, ticks,
+                get_player_coord_from_state(child), abstraction.signature(child),
+                reached_target(child, target_x, target_y),
+            ))
+        return children
+
+    game.simulating = True
+    while True:
+        requests = conn.recv()
+        if requests is None:
+            break
+        try:
+            conn.send(('ok', [expand(node_id, chain) for node_id, chain in requests]))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+def navigate_parallel(game, target_x, target_y, n_workers, progress, timeout=TIMEOUT, player_only=False):
+    initial_keys = game.__dict__['raw_pressed_keys']
+
+    game.simulating = True
+    init_state = game.backup()
+    abstraction = StateAbstraction()
+    table = TranspositionTable()
+    pq = []
+    n_iter = 0
+    workers = []
+    best = None
+    n_reported = 0
+
+    start = last_report = time.time()
+    try:
+        hack.player_only_ticks.active = player_only
+        probe_keys = POSSIBLE_KEYS if game.player.platformer_rules else POSSIBLE_KEYS_SCROLLER
+        cost_model = CostModel(
+            target_x, target_y, *probe_max_speed(game, init_state, probe_keys),
+            grid=None if game.tiled_map is None else occupancy_for(game))
+
+        ctx = multiprocessing.get_context('fork')
+        for _ in range(n_workers):
+            conn, worker_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main, args=(worker_conn, game, init_state, target_x, target_y, cost_model, abstraction),
+                daemon=True)
+            process.start()
+            worker_conn.close()
+            workers.append((process, conn))
+
+        signature = abstraction.signature(init_state)
+        key, _ = table.lookup(signature)
+        root = Node(
+            0, None, None, None, 0, 0, get_player_coord_from_state(init_state), key,
+            reached_target(init_state, target_x, target_y), None, cost_model,
+        )
+        table.store(key, signature, 0, root.coord)
+        n_nodes = 1
+        pq.append(root)
+
+        while len(pq) > 0:
+            now = time.time()
+            if now - start > timeout:
+                hack._G_WINDOW.console_add_msg('Path finding timed out')
+                raise TimeoutError('Path finding timed out')
+            if best is not None and now - last_report > progress.interval:
+                last_report = now
+                new_visited = list(table.coords.values())[n_reported:]
+                n_reported += len(new_visited)
+                progress.update(new_visited, [edge.coord for edge in best.chain()])
+                match progress.stop_requested():
+                    case 'cancel':
+                        hack._G_WINDOW.console_add_msg('Path finding cancelled')
+                        raise TimeoutError('Path finding cancelled')
+                    case 'accept':
+                        return finish_path(game, init_state, best.edges())
+
+            batch = []
+            while pq and len(batch) < n_workers * BATCH_SIZE:
+                node = heapq.heappop(pq)
+                if node.cost > table.costs[node.state_key]:
+                    continue  # re-opened with a lower cost since
+                if node.reached:
+                    path = finish_path(game, init_state, node.edges(), (target_x, target_y))
+                    if path is not None:
+                        return path
+                    continue
+                if best is None or node.heuristic < best.heuristic:
+                    best = node
+                batch.append(node)
+            n_iter += len(batch)
+
+            # keep nodes on the worker holding their state while it has room
+            assigned = [[] for _ in workers]
+            for node in batch:
+                owner = node.owner
+                if owner is None or len(assigned[owner]) >= BATCH_SIZE:
+                    owner = min(range(len(workers)), key=lambda i: len(assigned[i]))
+                assigned[owner].append(node)
+            for (_, conn), worker_nodes in zip(workers, assigned):
+                conn.send([
+                    (node.id, [(n.wid(), n.macro, n.ticks) for n in node.chain()])
+                    for node in worker_nodes
+                ])
+
+            for worker, ((_, conn), worker_nodes) in enumerate(zip(workers, assigned)):
+                status, results = conn.recv()
+                if status != 'ok':
+                    raise RuntimeError('path finding worker failed:\n' + results)
+                for node, children in zip(worker_nodes, results):
+                    for macro_index, macro, ticks, coord, signature, reached in children:
+                        key, known_cost = table.lookup(signature)
+                        cost = node.cost + ticks
+                        if known_cost is not None and (cost_model.mode == 'greedy' or known_cost <= cost):
+                            continue
+                        child = Node(
+                            n_nodes, node, macro_index, macro, ticks, cost,
+                            coord, key, reached, worker, cost_model,
+                        )
+                        n_nodes += 1
+                        table.store(key, signature, cost, coord)
+                        heapq.heappush(pq, child)
+    except Exception as e:
+        logging.exception(e)
+        game.restore(init_state)
+        if not isinstance(e, TimeoutError):
+            raise
+    finally:
+        for process, conn in workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, conn in workers:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        hack.player_only_ticks.active = False
+        game.__dict__['raw_pressed_keys'] = initial_keys
+        game.simulating = False
+        hack._G_WINDOW.console_add_msg(
+            f'{n_iter} steps on {n_workers} workers, {table.stats()}, queue depth {len(pq)}')
+        search_counters.add(n_iter, table, start)
+        game.__dict__['visited'] = list(table.coords.values())
@@ -1,9 +1,14 @@
+import hashlib
 import math
 import heapq
+import itertools
+import marshal
+import multiprocessing
 import time
 import logging
 import arcade
 import hack
+from hack.occupancy import occupancy_for
 
 POSSIBLE_KEYS = [
     (arcade.key.D,),
@@ -32,10 +37,46 @@ POSSIBLE_KEYS_SCROLLER = [
     (),
 ]
 
-GRANULARITY = 16
+GRANULARITY = 16  # pixels per cell of the state abstraction grid
 PRESSING_LENGTH = 5
 TIMEOUT = 5.
 
+# macro actions, see macros_for
+RUN_TICKS = (2, 5, 10, 20)
+AIR_TICKS = (2, 5)
+JUMP_TAP_TICKS = (1, 3, 6, 10)  # how long jump is held, the direction is held PRESSING_LENGTH ticks more
+
+# 'astar' orders the frontier by ticks so far + HEURISTIC_WEIGHT * estimated
+# ticks left (weighted A* when the weight is above 1), 'greedy' by the
+# estimate only.
+SEARCH_MODE = 'astar'
+PROBE_TICKS = 20
+# the probe can't see falls and other speed-ups that last longer than it,
+# the probed speeds are scaled by this so the estimate rarely overshoots
+PROBE_SPEED_MARGIN = 2.0
+# weighted A* by default: the margin makes the estimate weak, plain A* would
+# spread out over far too many states to find paths on large maps in time
+HEURISTIC_WEIGHT = 2.5
+
+# expand the search in this many forked worker processes, 0 to search serially
+PARALLEL_WORKERS = 0
+
+# search with ticks that only move the player and the platforms, and replay
+# the path with full ticks at the end
+PLAYER_ONLY_ROLLOUTS = False
+
+# a leg that can't be found in time is split at points on the straight line
+# to its target, at most this many times over
+SUBGOAL_DEPTH = 2
+SUBGOAL_SPACING = 200  # pixels between sub-goals along open stretches
+VERIFY_TOLERANCE = 0.5  # pixels
+
+# what two states must share to count as the same search node, see StateAbstraction
+STATE_SPEED_GRID = 1
+STATE_PLAYER_ATTRS = ('in_the_air', 'jump_override', 'health')
+STATE_PLATFORMS = True
+STATE_RNG = False  # the rng moves on most ticks, keying on it hardly merges anything
+
 
 def get_player_coord_from_state(state):
     player_properties = state.player[1].properties
@@ -68,17 +109,175 @@ def get_player_speed_from_state(state):
             y_speed = value
     return x_speed, y_speed
 
+class StateAbstraction:
+    """Boils a snapshot down to the parts the search tells states apart by."""
+
+    def __init__(
+            self,
+            grid=GRANULARITY,
+            speed_grid=STATE_SPEED_GRID,
+            player_attrs=STATE_PLAYER_ATTRS,
+            platforms=STATE_PLATFORMS,
+            rng=STATE_RNG,
+    ):
+        self.grid = grid
+        self.speed_grid = speed_grid
+        self.player_attrs = player_attrs
+        self.platforms = platforms
+        self.rng = rng
+
+    def signature(self, state) -> tuple:
+        player = dict(state.player[1].properties)
+        signature = [
+            int(player['x'] // self.grid), int(player['y'] // self.grid),
+            int(player['x_speed'] // self.speed_grid), int(player['y_speed'] // self.speed_grid),
+        ]
+        signature.extend(player.get(attr) for attr in self.player_attrs)
+        if self.platforms and state.tiled_map is not None:
+            for _, platform_state in state.tiled_map[1].moving_platforms:
+                platform = dict(platform_state.properties)
+                signature.append(int(platform['x'] // self.grid))
+                signature.append(int(platform['y'] // self.grid))
+        if self.rng:
+            rng = state.rng_system
+            signature.append(hash((rng.random_state, rng.frng_state, rng.prng_state)))
+        return tuple(signature)
+
+
+class TranspositionTable:
+    """Best known cost of each state seen by the search, keyed on the hash of its signature.
+
+    The signatures are kept as well when checking for collisions, to tell
+    hash collisions from states that really are the same."""
+
+    def __init__(self, check_collisions=True):
+        self.costs = {}
+        self.coords = {}  # player coords of the state first stored under each key, for drawing
+        self.signatures = {} if check_collisions else None
+        self.n_lookups = 0
+        self.n_hits = 0
+        self.n_collisions = 0
+        self.n_reopened = 0
+
+    def __len__(self):
+        return len(self.costs)
+
+    @staticmethod
+    def key(signature) -> int:
+        # not hash(), which collides a lot on small ints (hash(-1) == hash(-2))
+        return int.from_bytes(hashlib.blake2b(marshal.dumps(signature), digest_size=8).digest(), 'little')
+
+    def lookup(self, signature):
+        """Returns the key of signature and the best known cost under it, None if new."""
+        self.n_lookups += 1
+        key = self.key(signature)
+        cost = self.costs.get(key)
+        if cost is not None:
+            self.n_hits += 1
+            if self.signatures is not None and self.signatures[key] != signature:
+                self.n_collisions += 1
+        return key, cost
+
+    def store(self, key, signature, cost, coord):
+        if key in self.costs:
+            self.n_reopened += 1
+        else:
+            self.coords[key] = coord
+            if self.signatures is not None:
+                self.signatures[key] = signature
+        self.costs[key] = cost
+
+    def stats(self) -> str:
+        return '%d states, %d/%d hits, %d collisions, %d reopened' % (
+            len(self.costs), self.n_hits, self.n_lookups, self.n_collisions, self.n_reopened)
+
+
+class SearchCounters:
+    """Totals over every search since the last reset, for the benchmark."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_searches = 0
+        self.n_steps = 0
+        self.n_states = 0
+        self.seconds = 0.
+
+    def add(self, n_steps, table, start):
+        self.n_searches += 1
+        self.n_steps += n_steps
+        self.n_states += len(table.costs)
+        self.seconds += time.time() - start
+
+
+search_counters = SearchCounters()
+
+
+class SearchProgress:
+    """Hooks a running search reports to. The defaults let it run to the end."""
+    interval = 0.1  # seconds between updates
+
+    def update(self, new_visited, best_path):
+        """new_visited: player coords of the states visited since the last update,
+        best_path: player coords along the path to the node closest to the target so far"""
+
+    def stop_requested(self):
+        """None to keep searching, 'cancel' to give up or 'accept' to settle for the best path so far.
+        Keeps saying so once it did."""
+        return None
+
+
+class CostModel:
+    """Estimates the ticks left to the target from the player's top speed.
+
+    With an occupancy grid the estimate also goes around the static walls,
+    along the grid's distance field to the target. The top speed is probed
+    (see probe_max_speed), so the estimate is not a guaranteed lower bound
+    and A* may settle for a somewhat longer path."""
+
+    def __init__(self, dest_x, dest_y, max_x_speed, max_y_speed, mode=SEARCH_MODE, weight=HEURISTIC_WEIGHT,
+                 grid=None):
+        self.dest_x = dest_x
+        self.dest_y = dest_y
+        self.max_x_speed = max(max_x_speed, 1e-3)
+        self.max_y_speed = max(max_y_speed, 1e-3)
+        self.mode = mode
+        self.weight = weight
+        self.grid = grid
+        self.field = None if grid is None else grid.distance_field(dest_x, dest_y)
+        # fastest a step of the field can be taken
+        self.ticks_per_step = 0 if grid is None else grid.cell_size / max(self.max_x_speed, self.max_y_speed)
+
+    def heuristic(self, x, y):
+        ticks = max(abs(x - self.dest_x) / self.max_x_speed, abs(y - self.dest_y) / self.max_y_speed)
+        if self.field is not None:
+            steps = self.grid.distance(self.field, x, y)
+            if steps > 1:
+                # the player can start anywhere in its cell, so one step may be nearly free
+                ticks = max(ticks, (steps - 1) * self.ticks_per_step)
+        return ticks
+
+    def priority(self, cost, heuristic):
+        if self.mode == 'greedy':
+            return heuristic
+        # rounded so float noise does not beat the tie break on the heuristic
+        return round(cost + self.weight * heuristic, 6)
+
+
 class QueueElement:
-    def __init__(self, state, dest_x, dest_y, start_x, start_y):
+    def __init__(self, state, key, cost, cost_model, edge=None):
         self.state = state
-        self.heuristic = self.__heuristic(dest_x, dest_y, start_x, start_y)
-
-    def __heuristic(self, dest_x, dest_y, start_x, start_y):
-        player_x, player_y = get_player_coord_from_state(self.state)
-        return math.hypot(player_x - dest_x, player_y - dest_y)
+        self.key = key
+        self.cost = cost
+        self.edge = edge  # (macro, ticks, coord, edge of the parent) leading to state, None at the start
+        self.heuristic = cost_model.heuristic(*get_player_coord_from_state(state))
+        self.priority = cost_model.priority(cost, self.heuristic)
 
     def __lt__(self, other):
-        return self.heuristic < other.heuristic
+        if self.priority == other.priority:
+            return self.heuristic < other.heuristic
+        return self.priority < other.priority
 
 
 def get_outline(properties):
@@ -120,108 +319,416 @@ def distance(x1, y1, x2, y2):
     return ((x2 - x1)**2 + (y2 - y1)**2)**0.5
 
 
-def adjust_granularity(distance_to_target):
-    if distance_to_target > 500:
-        return 32
-    elif distance_to_target > 250:
-        return 16
-    elif distance_to_target > 100:
-        return 8
+def probe_max_speed(game, state, possible_keys):
+    """Fastest per-tick movement on each axis when holding any of the keys
+    from state for PROBE_TICKS ticks, times PROBE_SPEED_MARGIN."""
+    max_x_speed = abs(game.player.x_speed)
+    max_y_speed = abs(game.player.y_speed)
+    for keys in possible_keys:
+        game.restore(state)
+        game.__dict__['raw_pressed_keys'] = frozenset((arcade.key.LSHIFT, *keys))
+        x, y = game.player.x, game.player.y
+        for _ in range(PROBE_TICKS):
+            game.tick()
+            if game.player is None or game.player.dead:
+                break
+            max_x_speed = max(max_x_speed, abs(game.player.x - x))
+            max_y_speed = max(max_y_speed, abs(game.player.y - y))
+            x, y = game.player.x, game.player.y
+    game.restore(state)
+    return max_x_speed * PROBE_SPEED_MARGIN, max_y_speed * PROBE_SPEED_MARGIN
+
+
+def possible_keys_for(game, state):
+    if game.player.platformer_rules:
+        return POSSIBLE_KEYS if get_player_can_jump_from_state(state) else POSSIBLE_KEYS_NO_JUMP
+    return POSSIBLE_KEYS_SCROLLER
+
+
+def fitting_lengths(lengths, ticks_left):
+    # the longest that doesn't run past the target, and once it is closer
+    # than the longest of all, the shortest too for the fine steps
+    fitting = tuple(n for n in lengths if n <= ticks_left)
+    if not fitting:
+        return lengths[:1]
+    if fitting[-1] == lengths[-1]:
+        return fitting[-1:]
+    return tuple(sorted({lengths[0], fitting[-1]}))
+
+
+def macros_for(game, state, cost_model):
+    """The macro actions to branch on from state.
+
+    A macro is a sequence of (keys, ticks) segments held back to back. Moves
+    get longer the further away the target is, so long straight runs take a
+    single step, and steering in the air stays short. Jumps are a tap of
+    the jump key followed by the direction alone. Only one or two lengths
+    of each are tried, picked by the ticks left, see fitting_lengths.
+    """
+    ticks_left = cost_model.heuristic(*get_player_coord_from_state(state))
+    possible_keys = possible_keys_for(game, state)
+    if possible_keys is POSSIBLE_KEYS_NO_JUMP:
+        lengths = fitting_lengths(AIR_TICKS, ticks_left)
     else:
-        return 4
-
-def adjust_pressing_length(distance_to_target):
-    return 5
-
-def alias_coord(x, y, target_x, target_y):
-    dist_to_target = distance(x, y, target_x, target_y)
-    granularity = adjust_granularity(dist_to_target)
-    return x // granularity * granularity, y // granularity * granularity
+        lengths = fitting_lengths(RUN_TICKS, ticks_left)
+
+    macros = []
+    for keys in possible_keys:
+        if game.player.platformer_rules and arcade.key.W in keys:
+            direction = tuple(key for key in keys if key != arcade.key.W)
+            for tap in fitting_lengths(JUMP_TAP_TICKS, ticks_left):
+                macros.append(((keys, tap), (direction, PRESSING_LENGTH)))
+        else:
+            for length in lengths:
+                macros.append(((keys, length),))
+    return macros
+
+
+def reached_target(state, target_x, target_y):
+    outline = get_outline(state.player[1].properties)
+    return get_leftmost_point(outline) <= target_x <= get_rightmost_point(outline) and \
+        get_lowest_point(outline) <= target_y <= get_highest_point(outline)
+
+
+def static_grid(game):
+    """The occupancy grid when nothing but static walls can be bumped into."""
+    if game.tiled_map is None or game.tiled_map.moving_platforms:
+        return None
+    return occupancy_for(game)
+
+
+def target_reachable(game, target_x, target_y) -> bool:
+    if game.tiled_map is None:
+        return True
+    grid = occupancy_for(game)
+    if grid.is_solid(target_x, target_y):
+        hack._G_WINDOW.console_add_msg('Path finding target is inside a wall')
+        return False
+    x, y = game.player.x, game.player.y
+    if not grid.is_solid(x, y) and grid.distance(grid.distance_field(target_x, target_y), x, y) < 0:
+        hack._G_WINDOW.console_add_msg('Path finding target is walled off')
+        return False
+    return True
+
+
+def macro_keys(macro):
+    """The keys pressed on each tick of macro, with running held."""
+    for keys, length in macro:
+        keys = frozenset((arcade.key.LSHIFT, *keys))
+        for _ in range(length):
+            yield keys
+
+
+def hurt_or_bumped(game, health, grid=None):
+    if game.player.health < health - 10 or game.player.dead:
+        return True
+    player = game.player
+    if grid is not None and grid.box_free(
+            player.get_leftmost_point(), player.get_lowest_point(),
+            player.get_rightmost_point(), player.get_highest_point(), grid.cell_size):
+        return False
+    cx, cy, nb = game.physics_engine._get_collisions_list(game.player)
+    if len(cx):
+        return True
+    for o, mpv in cy:
+        if mpv[1] > 0:
+            return True
+    return False
+
+
+def rollout(game, state, macro):
+    """Plays macro from state.
+
+    Stops early when the player gets hurt or bumps into something. Returns
+    the number of ticks before that and the state after them, None if there
+    were none. Only that last state is backed up.
+    """
+    game.restore(state)
+    grid = static_grid(game)
+    ticks = 0
+    for keys in macro_keys(macro):
+        game.__dict__['raw_pressed_keys'] = keys
+        health = game.player.health
+        game.tick()
+        if hurt_or_bumped(game, health, grid):
+            if ticks == 0:
+                return 0, None
+            # the state before the bad tick is gone, play up to it again
+            return ticks, replay(game, state, macro, ticks, keep_states=False)[-1]
+        ticks += 1
+    return ticks, game.backup()
+
+
+def replay(game, state, macro, ticks, keep_states=True):
+    """Plays the first ticks ticks of macro from state, without the checks of rollout.
+
+    Returns the states after each tick, or only after the last one without keep_states.
+    """
+    game.restore(state)
+    states = []
+    for keys in itertools.islice(macro_keys(macro), ticks):
+        game.__dict__['raw_pressed_keys'] = keys
+        game.tick()
+        if keep_states:
+            states.append(game.backup())
+    if not keep_states:
+        states.append(game.backup())
+    return states
+
+
+def finish_path(game, init_state, edges, target=None):
+    """Replays the (macro, ticks, coord) edges of a path and returns the states after each tick.
+
+    A path found on player-only ticks is replayed with full ticks. The first
+    edge where the player ends up somewhere else than coord is reported, and
+    with a target, None is returned if the replayed path doesn't reach it.
+    """
+    player_only = hack.player_only_ticks.active
+    hack.player_only_ticks.active = False
+    try:
+        path = []
+        state = init_state
+        diverged = False
+        for i, (macro, ticks, coord) in enumerate(edges):
+            states = replay(game, state, macro, ticks)
+            path.extend(states)
+            state = states[-1]
+            dx, dy = game.player.x - coord[0], game.player.y - coord[1]
+            if not diverged and (abs(dx) > VERIFY_TOLERANCE or abs(dy) > VERIFY_TOLERANCE):
+                hack._G_WINDOW.console_add_msg(
+                    'Path diverged from the%s search at step %d/%d (tick %d) by (%.1f, %.1f)' % (
+                        ' player-only' if player_only else '', i + 1, len(edges), len(path), dx, dy))
+                diverged = True
+        if target is not None and path and not reached_target(path[-1], *target):
+            hack._G_WINDOW.console_add_msg('Replayed path misses the target, searching on')
+            game.restore(init_state)
+            return None
+        return path
+    finally:
+        hack.player_only_ticks.active = player_only
+
+
+def traceback(edge):
+    """The (macro, ticks, coord) edges from the start to edge."""
+    edges = []
+    while edge is not None:
+        macro, ticks, coord, edge = edge
+        edges.append((macro, ticks, coord))
+    edges.reverse()
+    return edges
+
+
+def subgoals(game, target_x, target_y) -> list:
+    """Points on the straight line from the player to the target to search to
+    one by one: both ends of every stretch of it that runs through walls, and
+    evenly spread points along the open stretches."""
+    x0, y0 = game.player.x, game.player.y
+    length = distance(x0, y0, target_x, target_y)
+    if game.tiled_map is None or length < SUBGOAL_SPACING:
+        return [((x0 + target_x) / 2, (y0 + target_y) / 2)] if length >= 2 * GRANULARITY else []
+    grid = occupancy_for(game)
+    n = int(length // grid.cell_size)
+    goals = []
+    last = x0, y0  # last goal, or the start
+    before, before_free = (x0, y0), True
+    for i in range(1, n):
+        point = x0 + (target_x - x0) * i / n, y0 + (target_y - y0) * i / n
+        free = grid.is_free(*point)
+        if free != before_free:
+            goal = point if free else before
+            if distance(*last, *goal) >= GRANULARITY:
+                goals.append(goal)
+        elif free and distance(*last, *point) >= SUBGOAL_SPACING:
+            goals.append(point)
+        if goals:
+            last = goals[-1]
+        before, before_free = point, free
+    return [goal for goal in goals if distance(*goal, target_x, target_y) >= 2 * GRANULARITY]
+
+
+def replay_keys(game, keys_seq):
+    """Plays keys_seq from the current state and returns the states after each tick."""
+    states = []
+    for keys in keys_seq:
+        game.__dict__['raw_pressed_keys'] = keys
+        game.tick()
+        states.append(game.backup())
+    return states
+
+
+def reuse_leg(game, keys_seq, target_x, target_y):
+    """The states of a leg found before, if its keys still reach the target from here."""
+    initial_keys = game.__dict__['raw_pressed_keys']
+    game.simulating = True
+    init_state = game.backup()
+    try:
+        states = replay_keys(game, keys_seq)
+    finally:
+        game.__dict__['raw_pressed_keys'] = initial_keys
+        game.simulating = False
+    if states and reached_target(states[-1], target_x, target_y):
+        return states
+    game.restore(init_state)
+    return None
 
 
-def traceback(visited, x, y, target_x, target_y, x_speed, y_speed):
+def _navigate_legs(game, targets, progress, timeout, leg_cache, use_navmesh, depth):
+    # returns the path as far as it got and whether it went all the way
     path = []
-    while True:
-        states_coord = visited.pop(alias_coord(x, y, target_x, target_y) + (x_speed, y_speed))
-        if states_coord is None:
-            break
-        path.extend(reversed(states_coord[0]))
-        x, y = states_coord[1]
-        x_speed, y_speed = states_coord[2]
-    return reversed(path)
+    for i, (x, y) in enumerate(targets):
+        leg_start = len(path)
+        leg = None
+        if leg_cache is not None and (x, y) in leg_cache:
+            leg = reuse_leg(game, leg_cache[x, y], x, y)
+        if leg is None:
+            leg = navigate(game, x, y, progress, timeout, use_navmesh=use_navmesh)
+            if leg and progress.stop_requested() is None and not reached_target(leg[-1], x, y):
+                path.extend(leg)  # navmesh legs that got stuck, go on from there
+                leg = None
+            if progress.stop_requested() is None and not leg and depth < SUBGOAL_DEPTH:
+                goals = subgoals(game, x, y)
+                if goals:
+                    hack._G_WINDOW.console_add_msg(f'Splitting leg {i + 1}/{len(targets)} at {len(goals)} sub-goals')
+                    leg, complete = _navigate_legs(
+                        game, goals + [(x, y)], progress, timeout, None, False, depth + 1)
+                    if not complete:
+                        path.extend(leg)
+                        leg = None
+            if leg and leg_cache is not None and progress.stop_requested() is None:
+                leg_cache[x, y] = [state.tick_keys for state in path[leg_start:] + leg]
+        if progress.stop_requested() == 'cancel':
+            return path, False
+        if not leg:
+            hack._G_WINDOW.console_add_msg(f'Path finding stuck at leg {i + 1}/{len(targets)}')
+            return path, False
+        path.extend(leg)
+        if progress.stop_requested() == 'accept':
+            return path, i == len(targets) - 1
+    return path, True
+
+
+def navigate_legs(game, targets, progress=None, timeout=TIMEOUT, leg_cache=None, use_navmesh=False):
+    """Searches to each of targets in turn, each leg from where the last one ended.
+
+    leg_cache maps targets to the keys of the legs found to them before; a
+    leg is played again instead of searched when its keys still reach the
+    target from where the previous leg ended, and the cache is updated with
+    the legs searched. A leg that can't be found is split at sub-goals.
+
+    Returns the path as far as it got, None if not even the first leg was found.
+    """
+    if progress is None:
+        progress = SearchProgress()
+    init_state = game.backup()
+    path, _ = _navigate_legs(game, targets, progress, timeout, leg_cache, use_navmesh, 0)
+    if progress.stop_requested() == 'cancel':
+        game.restore(init_state)
+        return None
+    return path or None
 
 
-def navigate(game, target_x, target_y):
+def navigate(game, target_x, target_y, progress=None, timeout=TIMEOUT, use_navmesh=True):
     if not game.player:
         return
 
+    if progress is None:
+        progress = SearchProgress()
+
+    if not target_reachable(game, target_x, target_y):
+        return
+
+    if use_navmesh:
+        from hack.navmesh import plan_waypoints
+        waypoints = plan_waypoints(game, target_x, target_y)
+        if waypoints:
+            hack._G_WINDOW.console_add_msg(f'Path finding through {len(waypoints)} navmesh waypoints')
+            return navigate_legs(game, waypoints + [(target_x, target_y)], progress, timeout)
+
+    # the workers are forked, without fork the search stays serial
+    if PARALLEL_WORKERS > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        from hack.parallel_search import navigate_parallel
+        return navigate_parallel(game, target_x, target_y, PARALLEL_WORKERS, progress, timeout, PLAYER_ONLY_ROLLOUTS)
+
     initial_keys = game.__dict__['raw_pressed_keys']
 
     game.simulating = True
     init_state = game.backup()
-    visited = {alias_coord(game.player.x, game.player.y, target_x, target_y) + (game.player.x_speed, game.player.y_speed): None}
-    start_x = game.player.x
-    start_y = game.player.y
-    pq = [QueueElement(init_state, target_x, target_y, start_x, start_y)]
+    abstraction = StateAbstraction()
+    table = TranspositionTable()
+    pq = []
     n_iter = 0
+    best = None  # (heuristic, edge) of the node closest to the target
+    n_reported = 0
 
-    start = time.time()
+    start = last_report = time.time()
     try:
+        hack.player_only_ticks.active = PLAYER_ONLY_ROLLOUTS
+        if game.player.platformer_rules:
+            probe_keys = POSSIBLE_KEYS
+        else:
+            probe_keys = POSSIBLE_KEYS_SCROLLER
+        cost_model = CostModel(
+            target_x, target_y, *probe_max_speed(game, init_state, probe_keys),
+            grid=None if game.tiled_map is None else occupancy_for(game))
+        signature = abstraction.signature(init_state)
+        key, _ = table.lookup(signature)
+        table.store(key, signature, 0, get_player_coord_from_state(init_state))
+        pq.append(QueueElement(init_state, key, 0, cost_model))
+
         while len(pq) > 0:
             n_iter += 1
-            if time.time() - start > TIMEOUT:
+            now = time.time()
+            if now - start > timeout:
                 hack._G_WINDOW.console_add_msg('Path finding timed out')
                 raise TimeoutError('Path finding timed out')
-            state = heapq.heappop(pq).state
-            coord = get_player_coord_from_state(state)
-            speed = get_player_speed_from_state(state)
-            outline = get_outline(state.player[1].properties)
-            if get_leftmost_point(outline) <= target_x <= get_rightmost_point(outline) and \
-                    get_lowest_point(outline) <= target_y <= get_highest_point(outline):
-                return traceback(visited, *coord, target_x, target_y, *speed)
-
-            possible_keys = None
-            if game.player.platformer_rules:
-                possible_keys = POSSIBLE_KEYS if get_player_can_jump_from_state(state) else POSSIBLE_KEYS_NO_JUMP
-            else:
-                possible_keys = POSSIBLE_KEYS_SCROLLER
-            for keys in possible_keys:
-                game.restore(state)
-                game.__dict__['raw_pressed_keys'] = frozenset((arcade.key.LSHIFT, *keys))
-
-                new_states = []
-                for _ in range(adjust_pressing_length(distance(game.player.x, game.player.y, target_x, target_y))):
-                    health = game.player.health
-                    game.tick()
-                    if game.player.health < health - 10 or game.player.dead:
-                        break
-                    cx, cy, nb = game.physics_engine._get_collisions_list(game.player)
-                    if len(cx):
-                        break
-                    collided = False
-                    for o, mpv in cy:
-                        if mpv[1] > 0:
-                            collided = True
-                            break
-                    if collided:
-                        break
-                    sss = game.backup()
-                    new_states.append(sss)
-                if new_states is None or len(new_states) == 0:
+            if best is not None and now - last_report > progress.interval:
+                last_report = now
+                new_visited = list(table.coords.values())[n_reported:]
+                n_reported += len(new_visited)
+                progress.update(new_visited, [coord for _, _, coord in traceback(best[1])])
+                match progress.stop_requested():
+                    case 'cancel':
+                        hack._G_WINDOW.console_add_msg('Path finding cancelled')
+                        raise TimeoutError('Path finding cancelled')
+                    case 'accept':
+                        return finish_path(game, init_state, traceback(best[1]))
+
+            element = heapq.heappop(pq)
+            if element.cost > table.costs[element.key]:
+                continue  # re-opened with a lower cost since
+            state = element.state
+            if reached_target(state, target_x, target_y):
+                path = finish_path(game, init_state, traceback(element.edge), (target_x, target_y))
+                if path is not None:
+                    return path
+                continue
+            if best is None or element.heuristic < best[0]:
+                best = element.heuristic, element.edge
+
+            for macro in macros_for(game, state, cost_model):
+                ticks, new_state = rollout(game, state, macro)
+                if new_state is None:
                     continue
 
-                new_coord = alias_coord(*get_player_coord_from_state(new_states[-1]), target_x, target_y) + get_player_speed_from_state(new_states[-1])
-                if new_coord not in visited:
-                    visited[new_coord] = new_states, coord, speed
-                    heapq.heappush(pq, QueueElement(new_states[-1], target_x, target_y, start_x, start_y))
+                signature = abstraction.signature(new_state)
+                new_key, known_cost = table.lookup(signature)
+                new_cost = element.cost + ticks
+                if known_cost is not None and (cost_model.mode == 'greedy' or known_cost <= new_cost):
+                    continue
+                new_coord = get_player_coord_from_state(new_state)
+                table.store(new_key, signature, new_cost, new_coord)
+                # the edge points at this very element, re-opening its key later can't re-parent it
+                edge = macro, ticks, new_coord, element.edge
+                heapq.heappush(pq, QueueElement(new_state, new_key, new_cost, cost_model, edge))
     except Exception as e:
         logging.exception(e)
         game.restore(init_state)
         if not isinstance(e, TimeoutError):
             raise
     finally:
+        hack.player_only_ticks.active = False
         game.__dict__['raw_pressed_keys'] = initial_keys
         game.simulating = False
-        hack._G_WINDOW.console_add_msg(f'{n_iter} steps, visited {len(visited)} states, queue depth {len(pq)}')
-        game.__dict__['visited'] = list(visited.keys())
-        open('dipshit.txt','w').write(str(game.backup()))
+        hack._G_WINDOW.console_add_msg(f'{n_iter} steps, {table.stats()}, queue depth {len(pq)}')
+        search_counters.add(n_iter, table, start)
+        game.__dict__['visited'] = list(table.coords.values())
@@ -0,0 +1,88 @@
+"""Per-subsystem timings of game ticks.
+
+Methods are wrapped once at import; while the profiler is off the wrappers
+only check a flag. Each section keeps its last PROFILER_WINDOW samples for
+rolling percentiles, and the last PROFILER_EVENTS calls are kept with their
+start time for exporting as a Chrome trace (chrome://tracing, Perfetto) or
+CSV.
+"""
+import csv
+import functools
+import json
+import os
+import time
+from collections import deque
+
+PROFILER_WINDOW = 600  # samples per section the percentiles are taken over
+PROFILER_EVENTS = 100000
+PERCENTILES = (50, 90, 99)
+
+
+class TickProfiler:
+    def __init__(self, window=PROFILER_WINDOW, max_events=PROFILER_EVENTS):
+        self.enabled = False
+        self.window = window
+        self.sections = []
+        self.samples = {}
+        self.events = deque(maxlen=max_events)  # (section, start, duration), seconds
+
+    def wrap(self, cls, method, section):
+        """Times every call of cls.method under section."""
+        original = getattr(cls, method)
+        if section not in self.samples:
+            self.sections.append(section)
+            self.samples[section] = deque(maxlen=self.window)
+
+        @functools.wraps(original)
+        def profiled(*args, **kwargs):
+            if not self.enabled:
+                return original(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(section, start, time.perf_counter() - start)
+
+        setattr(cls, method, profiled)
+
+    def record(self, section, start, duration):
+        self.samples[section].append(duration)
+        self.events.append((section, start, duration))
+
+    def reset(self):
+        for samples in self.samples.values():
+            samples.clear()
+        self.events.clear()
+
+    def percentiles(self, section) -> tuple:
+        samples = sorted(self.samples[section])
+        if not samples:
+            return (0.,) * len(PERCENTILES)
+        return tuple(samples[min(len(samples) - 1, len(samples) * p // 100)] for p in PERCENTILES)
+
+    def report(self) -> list:
+        """One line per section: calls in the window and the percentiles in ms."""
+        header = '{:<15}{:>6}'.format('section', 'calls') + ''.join('{:>8}'.format(f'p{p}') for p in PERCENTILES)
+        lines = [header]
+        for section in self.sections:
+            lines.append('{:<15}{:>6}'.format(section, len(self.samples[section])) + ''.join(
+                '{:>8.2f}'.format(t * 1e3) for t in self.percentiles(section)))
+        return lines
+
+    def export_chrome_trace(self, path):
+        events = [{
+            'name': section, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+            'ts': start * 1e6, 'dur': duration * 1e6,
+        } for section, start, duration in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('section', 'start_us', 'duration_us'))
+            for section, start, duration in self.events:
+                writer.writerow((section, round(start * 1e6, 1), round(duration * 1e6, 1)))
+
+
+tick_profiler = TickProfiler()
@@ -0,0 +1,107 @@
+"""Sim sessions on disk.
+
+A session is the whole timeline since the game started: the keys of every
+tick, already submitted or not, with the seek markers around map switches.
+Snapshots can't go in it, they only restore onto the live objects of the
+game that took them; the frames are re-simulated from the start of the game
+when they are first looked at instead, the way the server does it.
+
+File layout: SESSION_MAGIC, the length of a JSON header as uint32, the
+header, then one uint16 per frame indexing the distinct key sets listed in
+the header, or SEEK_MARKER / NO_TICK. The file is memory-mapped and the
+frame codes are read straight out of the map.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+SESSION_DIR = 'sessions'
+SESSION_MAGIC = b'HACKSES1'
+SESSION_VERSION = 1
+SEEK_MARKER = 0xFFFF
+NO_TICK = 0xFFFE
+
+_HEADER_LEN = struct.Struct('<I')
+
+
+class Session:
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__map[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a session file')
+        offset = len(SESSION_MAGIC)
+        header_len, = _HEADER_LEN.unpack_from(self.__map, offset)
+        offset += _HEADER_LEN.size
+        self.header = json.loads(self.__map[offset:offset + header_len])
+        if self.header['version'] != SESSION_VERSION or self.header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError(f'{path} is a version {self.header["version"]} {self.header["byteorder"]} endian session')
+        offset += header_len
+        self.keysets = [frozenset(keys) for keys in self.header['keysets']]
+        self.codes = memoryview(self.__map)[offset:offset + 2 * self.header['n_frames']].cast('H')
+
+    @property
+    def index(self) -> int:
+        return self.header['index']
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        """The keys of each frame, None for a seek marker and NO_TICK for a frame without a tick."""
+        keysets = self.keysets
+        for code in self.codes:
+            if code == SEEK_MARKER:
+                yield None
+            elif code == NO_TICK:
+                yield NO_TICK
+            else:
+                yield keysets[code]
+
+    def close(self):
+        if getattr(self, 'codes', None) is not None:
+            self.codes.release()
+            self.codes = None
+        self.__map.close()
+        self.__file.close()
+
+
+def session_path(name) -> str:
+    return os.path.join(SESSION_DIR, name + '.session')
+
+
+def save_session(path, frames, index, current_map):
+    """Writes frames, each the keys of a tick, None for a seek marker or NO_TICK."""
+    keysets = {}
+    codes = array('H')
+    for keys in frames:
+        if keys is None:
+            codes.append(SEEK_MARKER)
+        elif keys is NO_TICK:
+            codes.append(NO_TICK)
+        else:
+            codes.append(keysets.setdefault(frozenset(keys), len(keysets)))
+    if len(keysets) >= NO_TICK:
+        raise ValueError('too many distinct key sets for a session file')
+
+    header = json.dumps({
+        'version': SESSION_VERSION,
+        'byteorder': sys.byteorder,  # the codes are read in place, in native order
+        'map': current_map,
+        'n_frames': len(codes),
+        'index': index,
+        'keysets': [sorted(keys) for keys in keysets],
+    }).encode()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(SESSION_MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        f.write(codes.tobytes())
+    os.replace(path + '.tmp', path)
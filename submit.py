@@ -0,0 +1,154 @@
+"""Sending submitted sim frames to the server off the GUI thread.
+
+The GUI thread feeds the messages in with `pump()` once per frame, at most
+SUBMIT_BATCH at a time and only while the queue has room, and the sender
+thread sends whatever is queued in batches, no faster than SUBMIT_RATE
+messages per second if that is set. Server responses are polled on the GUI
+thread, which stops the pipeline as soon as cheating is detected; it holds
+net_lock while it does, as the connection can't be used from both threads
+at once.
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+
+SUBMIT_BATCH = 64  # messages moved per pump() and sent per wakeup of the sender
+SUBMIT_QUEUE = 1024  # messages queued ahead of the sender
+SUBMIT_RATE = 0  # messages per second, 0 for as fast as the connection goes
+
+_STOP = object()  # queued by close() to stop the sender
+
+
+class SubmitPipeline:
+    def __init__(self, net, batch=SUBMIT_BATCH, max_queued=SUBMIT_QUEUE, rate=SUBMIT_RATE):
+        self.net = net
+        self.batch = batch
+        self.rate = rate
+        self.sources = collections.deque()  # iterables of messages still to be queued
+        self.pending = None  # message taken from the sources that didn't fit in the queue yet
+        self.net_lock = threading.Lock()
+        self.queue = queue.Queue(max_queued)
+        self.n_total = 0
+        self.n_queued = 0
+        self.n_sent = 0
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name='submit', daemon=True)
+        self.thread.start()
+
+    def extend(self, messages, n):
+        """Adds n more messages to send after the ones already in."""
+        self.sources.append(iter(messages))
+        self.n_total += n
+
+    def pump(self):
+        """Moves the next messages into the queue while it has room. GUI thread only."""
+        for _ in range(self.batch):
+            if self.cancelled.is_set():
+                return
+            message = self.pending
+            if message is None:
+                if not self.sources:
+                    return
+                try:
+                    message = next(self.sources[0])
+                except StopIteration:
+                    self.sources.popleft()
+                    continue
+                if message is None:
+                    # a tick that sent nothing, there is nothing to send for it either
+                    logging.warning('no message for submitted frame %d, skipped', self.n_queued + 1)
+                    self.n_total -= 1
+                    continue
+            try:
+                self.queue.put_nowait(message)
+            except queue.Full:
+                self.pending = message
+                return
+            self.pending = None
+            self.n_queued += 1
+
+    def done(self) -> bool:
+        return self.cancelled.is_set() or (
+            not self.sources and self.pending is None and self.n_sent >= self.n_queued)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.sources.clear()
+        self.pending = None
+
+    def close(self):
+        self.cancel()
+        try:
+            self.queue.put_nowait(_STOP)  # wakes the sender up if it is waiting
+        except queue.Full:
+            pass
+        self.thread.join(timeout=1)
+
+    def __run(self):
+        next_send = time.perf_counter()
+        while True:
+            messages = [self.queue.get()]
+            while len(messages) < self.batch:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for message in messages:
+                if message is _STOP or self.cancelled.is_set():
+                    return
+                if self.rate:
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_send = max(next_send, time.perf_counter() - 1) + 1 / self.rate
+                try:
+                    with self.net_lock:
+                        self.net.send_one(message)
+                except Exception as e:
+                    logging.exception(e)
+                    self.error = e
+                    self.cancelled.set()
+                    return
+                self.n_sent += 1
+
+
+class LoopbackNet:
+    """Local stand-in for the server connection, for trying out the pipeline:
+    takes latency seconds per message and reports cheating from message
+    cheat_at on."""
+
+    def __init__(self, latency=0.001, cheat_at=None):
+        self.latency = latency
+        self.cheat_at = cheat_at
+        self.received = []
+        self.lock = threading.Lock()
+
+    def send_one(self, msg):
+        time.sleep(self.latency)
+        with self.lock:
+            self.received.append(msg)
+
+    def cheating_detected(self) -> bool:
+        with self.lock:
+            return self.cheat_at is not None and len(self.received) > self.cheat_at
+
+
+if __name__ == '__main__':
+    net = LoopbackNet(cheat_at=1500)
+    pipeline = SubmitPipeline(net)
+    pipeline.extend(({'tick': i} for i in range(3000)), 3000)
+    start = time.perf_counter()
+    while not pipeline.done():
+        pipeline.pump()
+        with pipeline.net_lock:
+            cheating = net.cheating_detected()
+        if cheating:
+            pipeline.cancel()
+        time.sleep(1 / 60)
+    pipeline.close()
+    print('%d/%d sent in %.2fs, %s' % (
+        pipeline.n_sent, pipeline.n_total, time.perf_counter() - start,
+        'cancelled' if pipeline.cancelled.is_set() else 'done'))